@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# coding: utf-8
+# batch_price.py
+
+"""
+Command-line bulk pricer for position files.
+
+Contracts are streamed from a CSV or Parquet file in fixed-size chunks, priced with BatchPricer
+(the same contract fields and outputs as POST /api/price) and appended to the output file chunk
+by chunk, in input order. With --workers > 1 the chunks are priced on a process pool; at most
+2 * workers chunks are in flight, so the memory stays flat whatever the size of the file.
+
+    python batch_price.py positions.csv priced.csv --chunk-size 50000 --workers 4
+
+Every input column is kept in the output, followed by the priced outputs and an error column
+(empty for priced contracts), which holds the validation or pricing error of the others. Parquet
+files need pyarrow.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from options.batch import BatchPricer, OUTPUTS
+
+FORMATS = ['csv', 'parquet']
+
+def _format(path, fmt=None):
+    ''' Returns the file format, given or guessed from the extension'''
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown file format {fmt!r}, expected one of {FORMATS}')
+    return fmt
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet files need pyarrow: pip install pyarrow')
+    return pyarrow
+
+def read_chunks(path, chunk_size, fmt=None):
+    ''' Yields the contracts of a CSV or Parquet file as DataFrames of at most chunk_size rows'''
+    if _format(path, fmt) == 'csv':
+        # Keep the text columns (contract_type, exp, model...) as strings
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype={'contract_type': str, 'exp': str, 'model': str})
+    else:
+        parquet = _pyarrow().parquet.ParquetFile(path)
+        for batch in parquet.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+
+class ChunkWriter(object):
+    """
+        Appends priced chunks to a CSV or Parquet file, as rendered by render_chunk.
+        The file is created by the first chunk, which also sets the CSV header and the Parquet schema.
+
+        Attributes:
+        path : str [output file]
+        fmt : str ['csv' or 'parquet']
+        rows : int [# of rows written]
+    """
+    def __init__(self, path, fmt=None):
+        self.path = path
+        self.fmt = _format(path, fmt)
+        self.rows = 0
+        self._file = None
+
+    def write(self, rendered):
+        if self.fmt == 'csv':
+            if self._file is None:
+                self._file = open(self.path, 'w', newline='')
+                self._file.write(','.join(rendered['columns']) + '\n')
+            self._file.write(rendered['data'])
+        else:
+            pa = _pyarrow()
+            table = pa.Table.from_pandas(rendered['data'], preserve_index=False)
+            if self._file is None:
+                self._file = pa.parquet.ParquetWriter(self.path, table.schema)
+            self._file.write_table(table.cast(self._file.schema))
+        self.rows += rendered['rows']
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def price_chunk(chunk):
+    ''' Prices one chunk of contracts and returns its outputs, row-aligned with the chunk: DataFrame'''
+    contracts = chunk.to_dict('records')
+    # Blank cells are missing fields, not NaN values
+    sparse = [key for key in chunk.columns if chunk[key].isna().any()]
+    for contract in contracts:
+        for key in sparse:
+            value = contract[key]
+            if value is None or value != value:
+                del contract[key]
+    pricer = BatchPricer(contracts)
+
+    outputs = {key: np.full(len(contracts), np.nan) for key in OUTPUTS}
+    error = np.full(len(contracts), '', dtype=object)
+    for i, message in pricer.errors:
+        error[i] = message
+
+    if pricer.rows:
+        valid = np.flatnonzero(error == '')
+        try:
+            results = [(valid, pricer.price())]
+        except Exception:
+            # Price the rows one by one, so that only the contracts that fail get an error
+            results = []
+            for k, i in enumerate(valid):
+                try:
+                    results.append(([i], pricer.price(k, k + 1)))
+                except Exception as e:
+                    error[i] = str(e) or type(e).__name__
+        for index, priced in results:
+            for key in OUTPUTS:
+                outputs[key][index] = np.array(priced[key], dtype=float)
+
+    outputs['error'] = error
+    return pd.DataFrame(outputs)
+
+def render_chunk(chunk, fmt='csv'):
+    '''
+        Prices one chunk and returns it ready to be written: {columns, data, rows, failed}
+        data is the CSV text of the rows (without header) or the priced DataFrame for Parquet,
+        so that the workers, not the writer, pay for the CSV formatting.
+    '''
+    outputs = price_chunk(chunk)
+    priced = pd.concat([chunk.reset_index(drop=True), outputs], axis=1)
+    return {
+        'columns': list(priced.columns),
+        'data': priced.to_csv(index=False, header=False) if fmt == 'csv' else priced,
+        'rows': len(priced),
+        'failed': int((outputs['error'] != '').sum()),
+    }
+
+def run(source, target, chunk_size=10000, workers=1, input_format=None, output_format=None):
+    ''' Prices every contract of source into target and returns the # of rows and failed rows'''
+    failed = 0
+    with ChunkWriter(target, output_format) as writer:
+        chunks = read_chunks(source, chunk_size, input_format)
+        if workers <= 1:
+            for chunk in chunks:
+                rendered = render_chunk(chunk, writer.fmt)
+                writer.write(rendered)
+                failed += rendered['failed']
+            return writer.rows, failed
+
+        # A bounded window of chunks in flight, written back in input order
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk in chunks:
+                pending.append(executor.submit(render_chunk, chunk, writer.fmt))
+                while pending and (len(pending) >= 2 * workers or pending[0].done()):
+                    rendered = pending.popleft().result()
+                    writer.write(rendered)
+                    failed += rendered['failed']
+            while pending:
+                rendered = pending.popleft().result()
+                writer.write(rendered)
+                failed += rendered['failed']
+
+        return writer.rows, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Price the contracts of a CSV or Parquet position file')
+    parser.add_argument('input', help='CSV or Parquet file of contracts')
+    parser.add_argument('output', help='CSV or Parquet file of priced contracts')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='contracts per chunk (default 10000)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='pricing processes (default: # of CPUs)')
+    parser.add_argument('--input-format', choices=FORMATS, help='default: from the file extension')
+    parser.add_argument('--output-format', choices=FORMATS, help='default: from the file extension')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        rows, failed = run(args.input, args.output, max(args.chunk_size, 1), args.workers, args.input_format, args.output_format)
+    except (ImportError, ValueError) as e:
+        parser.error(str(e))
+    elapsed = time.perf_counter() - start
+    print(f'Priced {rows} contracts ({failed} with errors) in {elapsed:.2f}s, {rows / max(elapsed, 1e-9):,.0f} contracts/s', file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
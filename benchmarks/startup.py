@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# coding: utf-8
+# benchmarks/startup.py
+
+"""
+Cold-start budget of the web application.
+
+Every round starts a fresh interpreter with -X importtime, imports main and serves a first GET / and
+a first Black-Scholes POST /bs, which is what a serverless cold start pays before answering. The
+report gives the median time from the start of `import main` to the end of each step, the modules
+imported directly by main with their cumulative import time, and the heavy modules (NumPy, pandas)
+already loaded after `import main`.
+
+    python -m benchmarks.startup --budget 300
+    python -m benchmarks.startup --save startup.json
+    python -m benchmarks.startup --compare startup.json
+
+The exit code is 1 when the median import time is over the budget, when a heavy module is loaded at
+import, or when a step is slower than the compared baseline by more than the threshold.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+HEAVY = ['numpy', 'pandas']
+STEPS = ['import', 'first_index', 'first_bs']
+
+# Run in the fresh interpreter, from the root of the repository
+PROBE = '''
+import json, sys, time
+from datetime import date, timedelta
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+loaded = [name for name in %r if name in sys.modules]
+client = main.app.test_client()
+client.get('/')
+index = time.perf_counter()
+client.post('/bs', data={'contract_type': 'C', 'market_price': '5', 'stock_price': '100', 'strike': '105',
+                         'exp': (date.today() + timedelta(days=365)).isoformat(), 'rf_rate': '5', 'vol': '20', 'div': '1'})
+bs = time.perf_counter()
+print(json.dumps({'import': imported - start, 'first_index': index - start, 'first_bs': bs - start, 'loaded': loaded}))
+''' % (HEAVY,)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def probe():
+    ''' Returns the timings of one cold start (seconds from the start of the import) and the import times of main's direct imports'''
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE], cwd=ROOT, capture_output=True, text=True)
+    process = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f'The startup probe failed:\n{completed.stderr[-2000:]}')
+
+    record = json.loads(completed.stdout.strip().splitlines()[-1])
+    record['process'] = process
+
+    # "import time: self [us] | cumulative [us] | name", nested imports are indented by two spaces
+    # and listed before the module that imports them
+    imports, pending = {}, {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            if name.strip() == 'main':
+                imports = pending
+            pending = {}
+        elif depth == 1:
+            pending[name.strip()] = int(cumulative) / 1e6
+    record['imports'] = imports
+    return record
+
+def run(rounds=5):
+    ''' Probes rounds cold starts and returns the report document'''
+    records = [probe() for _ in range(rounds)]
+    imports = {}
+    for record in records:
+        for name, seconds in record['imports'].items():
+            imports.setdefault(name, []).append(seconds)
+
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'rounds': rounds,
+        'seconds': {step: statistics.median(record[step] for record in records) for step in STEPS + ['process']},
+        'imports': {name: statistics.median(values) for name, values in imports.items()},
+        'loaded': sorted({name for record in records for name in record['loaded']}),
+    }
+
+def check(current, baseline=None, budget=None, threshold=0.25):
+    ''' Returns the flags of the report: over budget, heavy modules at import, slower than the baseline'''
+    flags = []
+    if budget is not None and current['seconds']['import'] * 1e3 > budget:
+        flags.append(f"import main takes {current['seconds']['import'] * 1e3:.1f} ms, over the {budget:.0f} ms budget")
+    for name in current['loaded']:
+        flags.append(f'{name} is imported at startup')
+    for step in STEPS:
+        old = (baseline or {}).get('seconds', {}).get(step)
+        if old and current['seconds'][step] / old > 1 + threshold:
+            flags.append(f"{step}: {current['seconds'][step] / old:.2f}x slower than the baseline ({old * 1e3:.1f} ms -> {current['seconds'][step] * 1e3:.1f} ms)")
+    return flags
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the cold start of the web application')
+    parser.add_argument('--rounds', type=int, default=5, help='fresh interpreters started, the median is kept (default 5)')
+    parser.add_argument('--budget', type=float, help='import time budget of main, in ms')
+    parser.add_argument('--top', type=int, default=10, help='# of direct imports of main listed (default 10)')
+    parser.add_argument('--save', metavar='PATH', help='write the report as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='compare against a saved report')
+    parser.add_argument('--threshold', type=float, default=0.25, help='relative slowdown flagged as a regression (default 0.25)')
+    args = parser.parse_args(argv)
+
+    current = run(max(args.rounds, 1))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    for step in STEPS + ['process']:
+        line = f"{step:<14} {current['seconds'][step] * 1e3:>10.1f} ms"
+        if baseline and step in baseline['seconds']:
+            line += f"   (baseline {baseline['seconds'][step] * 1e3:.1f} ms, {current['seconds'][step] / baseline['seconds'][step]:.2f}x)"
+        print(line)
+    print('imported by main:')
+    for name, seconds in sorted(current['imports'].items(), key=lambda item: -item[1])[:args.top]:
+        print(f'  {name:<30} {seconds * 1e3:>10.1f} ms')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    flags = check(current, baseline, args.budget, args.threshold)
+    for flag in flags:
+        print('OVER BUDGET', flag)
+    return 1 if flags else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
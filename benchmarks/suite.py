@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# coding: utf-8
+# benchmarks/suite.py
+
+"""
+Benchmark suite of the pricing engines.
+
+Every case times one engine on one point of a parameter sweep (chain sizes, NAS values, path counts,
+categories, tree steps and book sizes), records its throughput and peak memory, and checks its prices against the closed-form
+Black-Scholes prices. The asian and lookback Monte-Carlo prices are checked against their control variate runs (closed-form
+geometric Asian and vanilla prices) and their greeks against the bump greeks. The results are saved as a JSON baseline; later runs compared to a baseline flag
+every case slower than the baseline by more than the threshold, and every accuracy check that fails.
+
+    python -m benchmarks.suite --save benchmarks/baseline.json
+    python -m benchmarks.suite --compare benchmarks/baseline.json --threshold 0.25
+
+The exit code is 1 when a regression or an accuracy failure is flagged.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+from options.bs import BlackScholesOption, BlackScholesChain, BlackScholesIV
+from options.fdm import EuFdm, SCHEMES
+from options.monte_carlo import MonteCarloOption
+from options.lattice import LatticeOption, TREES
+from options.scenarios import ScenarioLadder
+from utils import graph
+
+SPOT, STRIKE, RATE, VOL, DTE, DIV = 100.0, 100.0, 5.0, 20.0, 1.0, 0.0
+
+class Case(object):
+    """
+        One benchmark case.
+
+        Attributes:
+        name : str [unique name, the key of the baseline]
+        run : callable [runs the case once and returns its result]
+        items : int [# of items priced per run, for the throughput]
+        check : callable|None [takes the result and returns (error, tolerance)]
+    """
+    def __init__(self, name, run, items=1, check=None):
+        self.name = name
+        self.run = run
+        self.items = items
+        self.check = check
+
+def _contracts(n, seed=7):
+    ''' Returns n random contracts around the money: spot, strike, rate, dte, vol, div'''
+    rng = np.random.default_rng(seed)
+    # Rounded as the engines round them, so that the checks compare like with like
+    return (np.full(n, SPOT), SPOT * rng.uniform(0.7, 1.3, n), rng.uniform(0, 8, n).round(2),
+            rng.uniform(0.05, 2, n).round(4), rng.uniform(10, 60, n).round(2), rng.uniform(0, 3, n).round(2))
+
+def _reference():
+    ''' Returns the closed-form call and put prices of the reference contract'''
+    chain = BlackScholesChain(SPOT, STRIKE, RATE, DTE, VOL, DIV)
+    return float(chain.callPrice), float(chain.putPrice)
+
+def _parity_error(option, spot, strike, rate, dte, div):
+    ''' Returns the put-call parity error of one priced contract'''
+    forward = spot * np.exp(-div / 100 * dte) - strike * np.exp(-rate / 100 * dte)
+    return abs(option.callPrice - option.putPrice - forward)
+
+def bs_cases(sizes):
+    cases = []
+
+    spot, strike, rate, dte, vol, div = _contracts(1000)
+    def scalar(spot=spot, strike=strike, rate=rate, dte=dte, vol=vol, div=div):
+        return [BlackScholesOption(spot[i], strike[i], rate[i], dte[i], vol[i], div[i]) for i in range(len(spot))]
+    def scalar_check(options, spot=spot, strike=strike, rate=rate, dte=dte, div=div):
+        return max(_parity_error(o, spot[i], strike[i], rate[i], dte[i], div[i]) for i, o in enumerate(options)), 1e-8
+    cases.append(Case('bs.option[n=1000]', scalar, 1000, scalar_check))
+
+    for n in sizes:
+        spot, strike, rate, dte, vol, div = _contracts(n)
+        def chain(spot=spot, strike=strike, rate=rate, dte=dte, vol=vol, div=div):
+            return BlackScholesChain(spot, strike, rate, dte, vol, div)
+        def chain_check(chain, spot=spot, strike=strike, rate=rate, dte=dte, div=div):
+            return float(np.max(_parity_error(chain, spot, strike, rate, dte, div))), 1e-8
+        cases.append(Case(f'bs.chain[n={n}]', chain, n, chain_check))
+
+        priced = BlackScholesChain(spot, strike, rate, dte, vol, div)
+        def iv(prices=priced.callPrice, spot=spot, strike=strike, rate=rate, dte=dte, div=div):
+            return BlackScholesIV(prices, spot, strike, rate, dte, div, 'C')
+        # The volatility of deep in-the-money contracts with no vega is not identified
+        def iv_check(iv, vol=vol, identified=priced.vega > 1e-4):
+            return float(np.max(np.abs(iv.vol - vol)[identified])), 1e-6
+        cases.append(Case(f'bs.iv[n={n}]', iv, n, iv_check))
+
+    return cases
+
+# Discretization error of the reference contract (max of the call and the put) as measured for each NAS
+FDM_ERRORS = {
+    'explicit': {20: 0.2035, 40: 0.0535, 80: 0.0135, 160: 0.0035},
+    'implicit': {20: 0.3206, 40: 0.0906, 80: 0.0306, 160: 0.0135},
+    'crank-nicolson': {20: 0.2706, 40: 0.0635, 80: 0.0206, 160: 0.0035},
+}
+
+def fdm_cases(nas_values):
+    cases = []
+    call, put = _reference()
+    for scheme in SCHEMES:
+        for NAS in nas_values:
+            def run(NAS=NAS, scheme=scheme):
+                return EuFdm(STRIKE, VOL, RATE, DTE, NAS, scheme=scheme)
+            def check(option, NAS=NAS, scheme=scheme):
+                # 25% above the measured error plus the rounding to the cent, 1% of the put for an unmeasured NAS
+                measured = FDM_ERRORS.get(scheme, {}).get(NAS)
+                tolerance = 0.01 * put if measured is None else 1.25 * measured + 0.005
+                return max(abs(option.callPrice - call), abs(option.putPrice - put)), tolerance
+            cases.append(Case(f'fdm.{scheme}[NAS={NAS}]', run, 1, check))
+    return cases
+
+def monte_carlo_cases(path_counts, timesteps=252):
+    cases = []
+    call, put = _reference()
+    for category in ('eu', 'asian', 'lookback'):
+        # A lookback struck at the spot has a kink there (the maximum can be the spot itself), so its delta is one-sided
+        strike = STRIKE * 1.05 if category == 'lookback' else STRIKE
+        args = (SPOT, strike, RATE, VOL, DTE, timesteps)
+        for n_sims in path_counts:
+            def run(n_sims=n_sims, category=category, args=args):
+                return MonteCarloOption(*args, n_sims, category, streaming=True)
+            if category == 'eu':
+                # Within 4 standard errors of the closed form
+                def check(option):
+                    return max(abs(option.callPrice - call) / option.callStdErr, abs(option.putPrice - put) / option.putStdErr), 4.0
+            else:
+                # The control variate moves the price by beta * (simulated - closed-form control mean): the simulated geometric
+                # Asian option for asian, the vanilla option on the last price for lookback, must match their closed forms
+                def check(option, n_sims=n_sims, category=category, args=args):
+                    controlled = MonteCarloOption(*args, n_sims, category, streaming=True, control_variate=True)
+                    return max(abs(option.callPrice - controlled.callPrice) / option.callStdErr,
+                               abs(option.putPrice - controlled.putPrice) / option.putStdErr), 4.0
+            cases.append(Case(f'monte_carlo.{category}[n_sims={n_sims}]', run, n_sims, check))
+
+            # The same run with its single-pass greeks
+            def run_greeks(n_sims=n_sims, category=category, args=args):
+                return MonteCarloOption(*args, n_sims, category, streaming=True, greeks='pathwise')
+            if category == 'eu':
+                def check_greeks(option):
+                    chain = BlackScholesChain(SPOT, STRIKE, RATE, DTE, VOL, DIV)
+                    exact = [chain.callDelta, chain.putDelta, chain.gamma, chain.gamma, chain.vega, chain.vega]
+                    return max(abs(getattr(option, name) - float(value)) / getattr(option, f'{name}StdErr')
+                               for name, value in zip(MonteCarloOption.GREEKS, exact)), 4.0
+            else:
+                # Against the reruns with common random numbers, whose errors are NaN with a single block of paths
+                def check_greeks(option, n_sims=n_sims, category=category, args=args):
+                    bump = MonteCarloOption(*args, n_sims, category, streaming=True, greeks='bump')
+                    errors = []
+                    for name in MonteCarloOption.GREEKS:
+                        std_err = np.hypot(getattr(option, f'{name}StdErr'), np.nan_to_num(getattr(bump, f'{name}StdErr')))
+                        errors.append(abs(getattr(option, name) - getattr(bump, name)) / max(std_err, 1e-12))
+                    return max(errors), 4.0
+            cases.append(Case(f'monte_carlo.{category}.greeks[n_sims={n_sims}]', run_greeks, n_sims, check_greeks))
+    return cases
+
+def lattice_cases(step_counts):
+    cases = []
+    call, put = _reference()
+    for tree in TREES:
+        for method in ('plain', 'bbsr'):
+            for steps in step_counts:
+                # European exercise, so that the tree converges to the closed form
+                def run(steps=steps, tree=tree, method=method):
+                    return LatticeOption(SPOT, STRIKE, RATE, DTE, VOL, DIV, steps=steps, tree=tree, american=False, method=method)
+                def check(option, steps=steps):
+                    # O(1/steps) convergence of the plain tree
+                    return max(abs(option.callPrice - call), abs(option.putPrice - put)), 2.0 / steps
+                cases.append(Case(f'lattice.{tree}.{method}[steps={steps}]', run, 1, check))
+    return cases
+
+def scenario_cases(sizes):
+    cases = []
+    # 20 spot shocks x 5 vol shocks x 4 horizons = 400 scenarios
+    spot_shocks, vol_shocks, horizons = np.arange(-20, 20, 2), [-10, -5, 0, 5, 10], [0, 1, 7, 30]
+    for n in sizes:
+        spot, strike, rate, dte, vol, div = _contracts(n)
+        book = {'underlying': np.arange(n) % 10, 'expiry': np.arange(n) % 4, 'contract_type': np.where(np.arange(n) % 2 == 0, 'C', 'P'),
+                'quantity': np.arange(n) % 7 - 3.0, 'spot': spot, 'strike': strike, 'rate': rate, 'dte': dte, 'vol': vol, 'div': div}
+        def run(book=book):
+            return ScenarioLadder(book, spot_shocks, vol_shocks, horizons)
+        def check(ladder, book=book):
+            # The spot ladder without vol or time shocks, repriced by the chain
+            chain = BlackScholesChain(book['spot'] * (1 + spot_shocks[:, None] / 100), book['strike'], book['rate'], book['dte'], book['vol'], book['div'])
+            values = np.where(book['contract_type'] == 'C', chain.callPrice, chain.putPrice) @ book['quantity']
+            return float(np.max(np.abs(ladder.total[:, 2, 0] - (values - ladder.value.sum())))), 1e-6
+        cases.append(Case(f'scenarios.ladder[n={n}]', run, n * 400, check))
+    return cases
+
+def graph_cases(widths):
+    cases = []
+    for width in widths:
+        lower, upper = int(SPOT - width / 2), int(SPOT + width / 2)
+        def run(lower=lower, upper=upper):
+            return graph(BlackScholesOption, 'C', upper, lower, STRIKE, RATE, VOL, DTE, DIV, None)
+        def check(data, lower=lower, upper=upper):
+            chain = BlackScholesChain(np.arange(lower, upper), STRIKE, RATE, DTE, VOL, DIV)
+            return float(np.max(np.abs(np.array(data['Delta']) - chain.callDelta))), 1e-12
+        cases.append(Case(f'utils.graph[width={width}]', run, width, check))
+    return cases
+
+def suite(quick=False):
+    ''' Returns the benchmark cases, quick=True keeps the smaller sweep points only'''
+    if quick:
+        return bs_cases([1000]) + fdm_cases([20, 40]) + monte_carlo_cases([10**4]) + lattice_cases([500]) + scenario_cases([1000]) + graph_cases([40])
+    return (bs_cases([10**3, 10**4, 10**5]) + fdm_cases([20, 40, 80, 160])
+            + monte_carlo_cases([10**4, 10**5]) + lattice_cases([500, 2000]) + scenario_cases([1000, 10**4]) + graph_cases([40, 160]))
+
+def measure(case, repeat=5, min_time=0.2):
+    ''' Times a case (best of repeat rounds, each running it at least min_time seconds) and traces its peak memory'''
+    result = case.run()
+    start = time.perf_counter()
+    case.run()
+    once = time.perf_counter() - start
+    number = max(1, int(min_time / max(once, 1e-9)))
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            case.run()
+        best = min(best, (time.perf_counter() - start) / number)
+
+    # Traced apart from the timings, tracemalloc slows down every allocation
+    tracemalloc.start()
+    case.run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    record = {'seconds': best, 'throughput': case.items / best, 'peak_bytes': peak}
+    if case.check is not None:
+        error, tolerance = case.check(result)
+        record.update(error=float(error), tolerance=float(tolerance), accurate=bool(error <= tolerance))
+    return record
+
+def run(cases, repeat=5, pattern=None):
+    ''' Runs the cases whose name contains pattern and returns the baseline document'''
+    results = {}
+    for case in cases:
+        if pattern and pattern not in case.name:
+            continue
+        results[case.name] = measure(case, repeat)
+        print(_line(case.name, results[case.name]), flush=True)
+
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+def compare(current, baseline, threshold=0.25):
+    ''' Returns the flags of the cases slower than the baseline by more than threshold or failing their accuracy check'''
+    flags = []
+    for name, record in current['results'].items():
+        if not record.get('accurate', True):
+            flags.append(f"{name}: accuracy error {record['error']:.3g} above {record['tolerance']:.3g}")
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        ratio = record['seconds'] / old['seconds']
+        if ratio > 1 + threshold:
+            flags.append(f"{name}: {ratio:.2f}x slower than the baseline ({old['seconds'] * 1e3:.3f} ms -> {record['seconds'] * 1e3:.3f} ms)")
+    return flags
+
+def _line(name, record):
+    accuracy = '' if 'accurate' not in record else f"  err {record['error']:.2e} {'ok' if record['accurate'] else 'FAIL'}"
+    return f"{name:<40} {record['seconds'] * 1e3:>10.3f} ms {record['throughput']:>14,.0f}/s {record['peak_bytes'] / 2**20:>9.2f} MiB{accuracy}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pricing engines')
+    parser.add_argument('--save', metavar='PATH', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH', help='flag regressions against a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='relative slowdown flagged as a regression (default 0.25)')
+    parser.add_argument('--repeat', type=int, default=5, help='timing rounds per case, the best one is kept')
+    parser.add_argument('--quick', action='store_true', help='run the smaller sweep points only')
+    parser.add_argument('-k', dest='pattern', help='only run the cases whose name contains this string')
+    args = parser.parse_args(argv)
+
+    current = run(suite(args.quick), args.repeat, args.pattern)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    baseline = {'results': {}}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    flags = compare(current, baseline, args.threshold)
+    for flag in flags:
+        print('REGRESSION', flag)
+    return 1 if flags else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
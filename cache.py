@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from threading import Lock
+import sys
+import time
+
+class ResultCache(object):
+    """
+        Bounded memoization of pricing results.
+        Entries are evicted least recently used first once the cache holds more than
+        max_entries results or more than max_bytes of (estimated) memory, and expire
+        ttl seconds after they were stored.
+
+        Keys are built with make_key, which rounds every float so that inputs differing
+        only by floating point noise share an entry.
+
+        Attributes:
+        max_entries : int [maximum # of cached results]
+        max_bytes : int [memory cap of the cached results]
+        ttl : float [seconds before an entry expires]
+        hits, misses, evictions, expirations : int [counters]
+    """
+    def __init__(self, max_entries=1024, max_bytes=64 * 2**20, ttl=300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        ''' Returns the cached value of key, or default on a miss'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        ''' Stores value under key, then evicts down to the entry and memory caps'''
+        size = _sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, time.monotonic(), size)
+            self.nbytes += size
+
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        ''' Returns the cached value of key, computing and storing it with compute() on a miss'''
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        ''' Returns the counters and the current size of the cache'''
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+            }
+
+    def _remove(self, key):
+        value, stored, size = self._entries.pop(key)
+        self.nbytes -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+def make_key(*parts, digits=6):
+    ''' Returns a hashable cache key with every float rounded to digits decimals'''
+    return tuple(round(part, digits) if isinstance(part, float) else part for part in parts)
+
+def _sizeof(value):
+    ''' Estimates the memory held by a result made of containers, strings, numbers and arrays'''
+    # NumPy arrays, checked without importing NumPy
+    if isinstance(getattr(value, 'nbytes', None), int):
+        return value.nbytes + sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+    return sys.getsizeof(value)
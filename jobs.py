@@ -0,0 +1,154 @@
+from importlib import import_module
+from threading import Lock
+import inspect
+import time
+import uuid
+
+# Engine classes by job kind, imported with the first job of their kind
+ENGINES = {'monte-carlo': 'options.monte_carlo.MonteCarloOption', 'fdm': 'options.fdm.EuFdm'}
+OUTPUTS = {
+    'monte-carlo': ['callPrice', 'putPrice', 'callStdErr', 'putStdErr', 'callCI', 'putCI',
+                    'callDelta', 'putDelta', 'callGamma', 'putGamma', 'callVega', 'putVega',
+                    'callDeltaStdErr', 'putDeltaStdErr', 'callGammaStdErr', 'putGammaStdErr', 'callVegaStdErr', 'putVegaStdErr'],
+    'fdm': ['callPrice', 'putPrice', 'callDelta', 'putDelta', 'callGamma', 'putGamma', 'callTheta', 'putTheta'],
+}
+
+class JobCancelled(Exception):
+    pass
+
+def _engine(kind):
+    ''' Returns the engine class of a job kind'''
+    module, name = ENGINES[kind].rsplit('.', 1)
+    return getattr(import_module(module), name)
+
+class JobManager(object):
+    """
+        Runs long Monte-Carlo and FDM pricings on a local process pool so that they do not
+        hold a request thread for the whole computation.
+
+        Jobs are submitted with the engine's constructor arguments and polled by id. The engines
+        report their progress (paths or time steps completed) through a shared dict, and a
+        running job is cancelled by a shared flag that its progress callback checks. The results
+        of the last max_jobs jobs are kept for later retrieval.
+
+        The pool and the shared state are only started on the first submission.
+
+        Attributes:
+        max_workers : int|None [# of worker processes, defaults to the # of CPUs]
+        max_jobs : int [# of finished jobs kept]
+    """
+    def __init__(self, max_workers=None, max_jobs=256):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self._jobs = {}
+        self._lock = Lock()
+        self._executor = None
+        self._manager = None
+        self._progress = None
+        self._cancelled = None
+
+    def _start(self):
+        if self._executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            from multiprocessing import Manager
+
+            self._manager = Manager()
+            self._progress = self._manager.dict()
+            self._cancelled = self._manager.dict()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, kind, params):
+        ''' Validates the arguments, queues the job and returns its id'''
+        if kind not in ENGINES:
+            raise ValueError(f'Unknown job kind {kind!r}, expected one of {list(ENGINES)}')
+        if not isinstance(params, dict):
+            raise ValueError('params must be an object')
+        try:
+            inspect.signature(_engine(kind)).bind(**params)
+        except TypeError as e:
+            raise ValueError(str(e))
+        if 'progress' in params:
+            raise ValueError('progress is set by the job manager')
+
+        with self._lock:
+            self._start()
+            job_id = uuid.uuid4().hex
+            future = self._executor.submit(_run_job, job_id, kind, params, self._progress, self._cancelled)
+            self._jobs[job_id] = {'kind': kind, 'params': params, 'future': future, 'submitted': time.time()}
+            self._prune()
+
+        return job_id
+
+    def status(self, job_id):
+        ''' Returns the state, progress and (once done) the result or error of a job, or None for an unknown id'''
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+
+        future = job['future']
+        status = {'id': job_id, 'kind': job['kind'], 'submitted': job['submitted']}
+        done, total = self._progress.get(job_id, (0, None))
+        status['progress'] = {'done': done, 'total': total}
+
+        # A cancel request only counts if the job stopped on it: a job that finished first keeps its result
+        if future.cancelled():
+            status['state'] = 'cancelled'
+        elif not future.done():
+            status['state'] = 'running' if future.running() else 'queued'
+        else:
+            error = future.exception()
+            if isinstance(error, JobCancelled):
+                status['state'] = 'cancelled'
+            elif error is not None:
+                status['state'] = 'failed'
+                status['error'] = f'{type(error).__name__}: {error}'
+            else:
+                status['state'] = 'done'
+                status['result'] = future.result()
+
+        return status
+
+    def cancel(self, job_id):
+        ''' Cancels a queued job or asks a running one to stop, finished jobs are left as they are. Returns False for an unknown id'''
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        future = job['future']
+        if not future.cancel() and not future.done():
+            self._cancelled[job_id] = True
+        return True
+
+    def _prune(self):
+        ''' Forgets the oldest finished jobs beyond max_jobs'''
+        finished = [job_id for job_id, job in self._jobs.items() if job['future'].done()]
+        for job_id in finished[:max(len(finished) - self.max_jobs, 0)]:
+            del self._jobs[job_id]
+            self._progress.pop(job_id, None)
+            self._cancelled.pop(job_id, None)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._manager.shutdown()
+            self._executor = None
+
+def _run_job(job_id, kind, params, progress, cancelled):
+    ''' Worker entry point: runs one pricing and returns its outputs'''
+    last = [0.0]
+
+    def report(done, total):
+        if cancelled.get(job_id):
+            raise JobCancelled(job_id)
+        # Throttle the updates of the shared dict
+        now = time.monotonic()
+        if done == total or now - last[0] > 0.1:
+            progress[job_id] = (done, total)
+            last[0] = now
+
+    option = _engine(kind)(**params, progress=report)
+    result = {}
+    for key in OUTPUTS[kind]:
+        value = getattr(option, key)
+        if value is not None:
+            result[key] = [float(x) for x in value] if isinstance(value, tuple) else float(value)
+    return result
@@ -2,28 +2,61 @@
 # coding: utf-8
 # main.py
 
-from options.bs import BlackScholesOption
-from options.monte_carlo import MonteCarloOption
-from options.fdm import EuFdm
-from flask import Flask
-from flask import request, render_template, json
+# The pricing engines (and NumPy with them) are imported by the routes that use them, on
+# their first request, so that a cold start only pays for Flask and the service modules.
+
+from flask import Flask, Blueprint
+from flask import request, render_template, json, abort, jsonify, Response, stream_with_context, g
 from werkzeug.exceptions import HTTPException
 from datetime import datetime
-from utils import graph, valuation
+from cache import ResultCache, make_key
+from jobs import JobManager
+from metrics import registry, RequestProfiler
+import os
+import time
+
+routes = Blueprint('pricer', __name__)
+
+# Memoization of the priced results, sized through the environment
+results_cache = ResultCache(max_entries=int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 1024)),
+                            max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', 64 * 2**20)),
+                            ttl=float(os.environ.get('RESULT_CACHE_TTL', 300)))
+
+# Background Monte-Carlo and FDM runs, the worker processes start with the first job
+job_manager = JobManager(max_workers=int(os.environ['JOB_WORKERS']) if 'JOB_WORKERS' in os.environ else None,
+                         max_jobs=int(os.environ.get('JOB_MAX_RETAINED', 256)))
+
+# Requests are profiled while the PROFILE_FLAG_FILE exists
+profiler = RequestProfiler(flag_file=os.environ.get('PROFILE_FLAG_FILE'), out_dir=os.environ.get('PROFILE_DIR', 'profiles'))
 
-app = Flask(__name__)
+@routes.before_app_request
+def start_timer():
+    g.start = time.perf_counter()
+    g.profile = profiler.start()
 
-@app.route('/', methods=['GET'])
+@routes.after_app_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if g.get('profile') is not None:
+        profiler.stop(g.profile, f'{request.method}-{route}')
+    if 'start' in g:
+        registry.observe('request_seconds', time.perf_counter() - g.start, route=route, method=request.method, status=response.status_code)
+    return response
+
+@routes.route('/', methods=['GET'])
 def index():
     return render_template('index.html')
 
-@app.route('/option/<_type>', methods=['GET'])
+@routes.route('/option/<_type>', methods=['GET'])
 def vanilla(_type):
     return render_template('option.html', _type=_type)
 
-@app.route('/bs', methods=['GET', 'POST'])
+@routes.route('/bs', methods=['GET', 'POST'])
 def bs():
     if request.method == 'POST':
+        from options.bs import BlackScholesOption
+        from utils import greek_profile, valuation
+
         contract_type = request.form['contract_type']
         market_price = float(request.form['market_price'])
         spot = float(request.form['stock_price'])
@@ -33,51 +66,57 @@ def bs():
         vol = float(request.form['vol'])
         div = float(request.form['div'])
 
-        if contract_type == 'C':
-            option = BlackScholesOption(spot, strike, rate, dte, vol, div, mktCallPrice=market_price)
-        else:
-            option = BlackScholesOption(spot, strike, rate, dte, vol, div, mktPutPrice=market_price)
-
-        opt_price = round(option.callPrice, 2) if contract_type == 'C' else round(option.putPrice, 2)
-        intrinsic_value = round(max(spot - strike, 0), 2) if contract_type == 'C' else round(max(strike - spot, 0), 2)
-        time_value = round(abs(intrinsic_value - opt_price), 2)
-
-        delta = str(round(option.callDelta, 4)) if contract_type == 'C' else str(round(option.putDelta, 4))
-        gamma = str(round(option.gamma, 4))
-        vega = str(round(option.vega, 4))
-        theta = str(round(option.callTheta, 4)) if contract_type == 'C' else str(round(option.putTheta, 4))
-        rho = str(round(option.callRho, 4)) if contract_type == 'C' else str(round(option.putRho, 4))
-        div_sens = str(round(option.callDivSens, 4)) if contract_type == 'C' else str(round(option.putDivSens, 4))
-        imp_vol = str(round(option.callImpliedVol(), 2)) if contract_type == 'C' else str(round(option.putImpliedVol(), 2))
-
-        difference = valuation(opt_price, market_price)
-
-        data = graph('BlackScholesOption', contract_type, int(spot * 1.2), int(spot * 0.8), strike, rate, vol, dte, div, market_price)
-
-        # print(data)
-
-        return render_template('bs.html',
-                               opt_price=opt_price,
-                               market_price=market_price,
-                               intrinsic_value=intrinsic_value,
-                               time_value=time_value,
-                               delta=delta,
-                               gamma=gamma,
-                               vega=vega,
-                               theta=theta,
-                               rho=rho,
-                               div_sens=div_sens,
-                               imp_vol=imp_vol,
-                               difference=difference,
-                               data=data
-                )
-                                
+        def price():
+            if contract_type == 'C':
+                option = BlackScholesOption(spot, strike, rate, dte, vol, div, mktCallPrice=market_price)
+            else:
+                option = BlackScholesOption(spot, strike, rate, dte, vol, div, mktPutPrice=market_price)
+
+            opt_price = round(option.callPrice, 2) if contract_type == 'C' else round(option.putPrice, 2)
+            intrinsic_value = round(max(spot - strike, 0), 2) if contract_type == 'C' else round(max(strike - spot, 0), 2)
+            time_value = round(abs(intrinsic_value - opt_price), 2)
+
+            delta = str(round(option.callDelta, 4)) if contract_type == 'C' else str(round(option.putDelta, 4))
+            gamma = str(round(option.gamma, 4))
+            vega = str(round(option.vega, 4))
+            theta = str(round(option.callTheta, 4)) if contract_type == 'C' else str(round(option.putTheta, 4))
+            rho = str(round(option.callRho, 4)) if contract_type == 'C' else str(round(option.putRho, 4))
+            div_sens = str(round(option.callDivSens, 4)) if contract_type == 'C' else str(round(option.putDivSens, 4))
+            imp_vol = str(round(option.callImpliedVol(), 2)) if contract_type == 'C' else str(round(option.putImpliedVol(), 2))
+
+            difference = valuation(opt_price, market_price)
+
+            data = greek_profile(contract_type, spot, strike, rate, vol, dte, div, lower=int(spot * 0.8), upper=int(spot * 1.2), step=1)
+
+            # print(data)
+
+            return dict(opt_price=opt_price,
+                        market_price=market_price,
+                        intrinsic_value=intrinsic_value,
+                        time_value=time_value,
+                        delta=delta,
+                        gamma=gamma,
+                        vega=vega,
+                        theta=theta,
+                        rho=rho,
+                        div_sens=div_sens,
+                        imp_vol=imp_vol,
+                        difference=difference,
+                        data=data)
+
+        context = results_cache.get_or_compute(make_key('bs', contract_type, market_price, spot, strike, dte, rate, vol, div), price)
+
+        return render_template('bs.html', **context)
+
     elif request.method == 'GET':
         return render_template('bs.html')
     
-@app.route('/fdm', methods=['GET', 'POST'])
+@routes.route('/fdm', methods=['GET', 'POST'])
 def fdm():
     if request.method == 'POST':
+        from options.fdm import EuFdm
+        from utils import valuation
+
         contract_type = request.form['contract_type']
         market_price = float(request.form['market_price'])
         spot = float(request.form['stock_price'])
@@ -86,31 +125,46 @@ def fdm():
         rate = float(request.form['rf_rate'])
         vol = float(request.form['vol'])
         steps = int(request.form['steps'])
+        scheme = request.form.get('scheme', 'explicit')
+
+        def price():
+            try:
+                option = EuFdm(strike, vol, rate, dte, steps, contract_type, scheme=scheme, spot=spot)
+            except ValueError as e:
+                abort(400, description=str(e))
+
+            opt_price = round(option.callPrice, 2) if contract_type == 'C' else round(option.putPrice, 2)
+            intrinsic_value = round(max(spot - strike, 0), 2) if contract_type == 'C' else round(max(strike - spot, 0), 2)
+            time_value = round(abs(intrinsic_value - opt_price), 2)
+
+            delta = str(option.callDelta) if contract_type == 'C' else str(option.putDelta)
+            gamma = str(option.callGamma) if contract_type == 'C' else str(option.putGamma)
+            theta = str(option.callTheta) if contract_type == 'C' else str(option.putTheta)
 
-        if contract_type == 'C':
-            option = EuFdm(strike, vol, rate, dte, steps)
-        else:
-            option = EuFdm(strike, vol, rate, dte, steps)
+            difference = valuation(opt_price, market_price)
 
-        opt_price = round(option.callPrice, 2) if contract_type == 'C' else round(option.putPrice, 2)
-        intrinsic_value = round(max(spot - strike, 0), 2) if contract_type == 'C' else round(max(strike - spot, 0), 2)
-        time_value = round(abs(intrinsic_value - opt_price), 2)
+            return dict(opt_price=opt_price,
+                        market_price=market_price,
+                        intrinsic_value=intrinsic_value,
+                        time_value=time_value,
+                        delta=delta,
+                        gamma=gamma,
+                        theta=theta,
+                        difference=difference)
 
-        difference = valuation(opt_price, market_price)
+        context = results_cache.get_or_compute(make_key('fdm', contract_type, market_price, spot, strike, dte, rate, vol, steps, scheme), price)
 
-        return render_template('fdm.html', 
-                                opt_price=opt_price,
-                                market_price=market_price,
-                                intrinsic_value=intrinsic_value,
-                                time_value=time_value,
-                                difference=difference)
+        return render_template('fdm.html', **context)
 
     elif request.method == 'GET':
         return render_template('fdm.html')
 
-@app.route('/monte-carlo/<category>', methods=['GET', 'POST'])
+@routes.route('/monte-carlo/<category>', methods=['GET', 'POST'])
 def monte_carlo(category):
     if request.method == 'POST':
+        from options.monte_carlo import MonteCarloOption
+        from utils import valuation
+
         contract_type = request.form['contract_type']
         market_price = float(request.form['market_price'])
         spot = float(request.form['stock_price'])
@@ -121,26 +175,96 @@ def monte_carlo(category):
         timesteps = int(request.form['timesteps'])
         n_sims = int(request.form['n_sims'])
 
-        option = MonteCarloOption(spot, strike, mu, sigma, horizon, timesteps, n_sims, category)
-        print(option.callPrice, option.putPrice)
-        opt_price = round(option.callPrice, 2) if contract_type == 'C' else round(option.putPrice, 2)
-        intrinsic_value = round(max(spot - strike, 0), 2) if contract_type == 'C' else round(max(strike - spot, 0), 2)
-        time_value = round(abs(intrinsic_value - opt_price), 2)
+        def price():
+            option = MonteCarloOption(spot, strike, mu, sigma, horizon, timesteps, n_sims, category, streaming=True)
+            opt_price = round(option.callPrice, 2) if contract_type == 'C' else round(option.putPrice, 2)
+            std_err = round(option.callStdErr, 4) if contract_type == 'C' else round(option.putStdErr, 4)
+            conf_int = option.callCI if contract_type == 'C' else option.putCI
+            conf_int = f'[{conf_int[0]:.2f}, {conf_int[1]:.2f}]'
+            intrinsic_value = round(max(spot - strike, 0), 2) if contract_type == 'C' else round(max(strike - spot, 0), 2)
+            time_value = round(abs(intrinsic_value - opt_price), 2)
+
+            difference = valuation(opt_price, market_price)
+
+            return dict(opt_price=opt_price,
+                        std_err=std_err,
+                        conf_int=conf_int,
+                        market_price=market_price,
+                        intrinsic_value=intrinsic_value,
+                        time_value=time_value,
+                        difference=difference,
+                        category=category)
 
-        difference = valuation(opt_price, market_price)
+        context = results_cache.get_or_compute(make_key('monte-carlo', category, contract_type, market_price, spot, strike, sigma, mu, horizon, timesteps, n_sims), price)
 
-        return render_template('monte_carlo.html', 
-                               opt_price=opt_price,
-                               market_price=market_price,
-                               intrinsic_value=intrinsic_value,
-                               time_value=time_value,
-                               difference=difference,
-                               category=category)
+        return render_template('monte_carlo.html', **context)
 
     elif request.method == 'GET':
         return render_template('monte_carlo.html', category=category)
 
-@app.errorhandler(HTTPException)
+@routes.route('/api/price', methods=['POST'])
+def price_batch():
+    """Price a JSON batch of contracts, optionally streamed back as newline-delimited JSON chunks."""
+    from options.batch import BatchPricer
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or 'contracts' not in payload:
+        abort(400, description='Expected a JSON object with a "contracts" list')
+
+    try:
+        pricer = BatchPricer(payload['contracts'])
+        chunk_size = int(payload.get('chunk_size', 1000))
+    except (TypeError, ValueError) as e:
+        abort(400, description=str(e))
+
+    if pricer.errors:
+        errors = [{'index': i, 'error': message} for i, message in pricer.errors]
+        return jsonify(code=400, name='Bad Request', description='Invalid contracts', errors=errors), 400
+
+    if payload.get('stream'):
+        chunks = (json.dumps(chunk) + '\n' for chunk in pricer.chunks(max(chunk_size, 1)))
+        return Response(stream_with_context(chunks), mimetype='application/x-ndjson')
+
+    return jsonify(pricer.price())
+
+@routes.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss/eviction counters of the result cache."""
+    return jsonify(results_cache.stats())
+
+@routes.route('/metrics', methods=['GET'])
+def metrics():
+    """Request and engine timings, IV counters and cache state in the Prometheus text format."""
+    for key, value in results_cache.stats().items():
+        registry.set(f'cache_{key}', value)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@routes.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a Monte-Carlo or FDM pricing and return its id right away."""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or 'kind' not in payload:
+        abort(400, description='Expected a JSON object with a "kind" and "params"')
+
+    try:
+        job_id = job_manager.submit(payload['kind'], payload.get('params', {}))
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    return jsonify(id=job_id, state='queued'), 202
+
+@routes.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job(job_id):
+    """Poll the state, progress and result of a job, or cancel it."""
+    if request.method == 'DELETE' and not job_manager.cancel(job_id):
+        abort(404, description=f'Unknown job {job_id}')
+
+    status = job_manager.status(job_id)
+    if status is None:
+        abort(404, description=f'Unknown job {job_id}')
+    return jsonify(status)
+
+@routes.app_errorhandler(HTTPException)
 def handle_exception(e):
     """Return JSON instead of HTML for HTTP errors."""
     # start with the correct headers and status code from the error
@@ -153,6 +277,14 @@ def handle_exception(e):
     })
     response.content_type = "application/json"
     return response   
-    
+
+def create_app():
+    ''' Returns the Flask application with the pricing routes, the request timing and profiling hooks and the JSON errors'''
+    app = Flask(__name__)
+    app.register_blueprint(routes)
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=5000, debug=True)
@@ -0,0 +1,209 @@
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+import cProfile
+import os
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram(object):
+    """
+        Cumulative histogram of observed values, in the Prometheus layout.
+
+        Attributes:
+        buckets : tuple [sorted upper bounds, +Inf is implied]
+        counts : list [# of observations per bucket, the last one being +Inf]
+        sum : float [sum of the observations]
+        count : int [# of observations]
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        ''' Returns the (upper bound, # of observations <= bound) pairs, +Inf last'''
+        total, pairs = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+class MetricsRegistry(object):
+    """
+        In-process registry of the service counters, gauges and histograms, rendered in the
+        Prometheus text exposition format by render().
+
+        Every metric is identified by its name and its labels. Metrics recorded in worker
+        processes (process pools of the engines and of the job manager) stay in those processes.
+
+        Attributes:
+        namespace : str [prefix of every metric name]
+    """
+    def __init__(self, namespace='pricer'):
+        self.namespace = namespace
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = Lock()
+
+    def describe(self, name, help):
+        self._help[name] = help
+
+    def inc(self, name, amount=1, **labels):
+        ''' Adds amount to a counter'''
+        with self._lock:
+            self._counters[name, _labels(labels)] += amount
+
+    def set(self, name, value, **labels):
+        ''' Sets a gauge'''
+        with self._lock:
+            self._gauges[name, _labels(labels)] = value
+
+    def observe(self, name, value, **labels):
+        ''' Records one observation in a histogram'''
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        ''' Observes the seconds spent in the with block'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        ''' Returns every metric in the Prometheus text exposition format'''
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self._counters), ('gauge', self._gauges)):
+                for name in sorted({name for name, labels in metrics}):
+                    lines += self._header(name, kind)
+                    for (key, labels), value in sorted(metrics.items()):
+                        if key == name:
+                            lines.append(f'{self.namespace}_{name}{_format(labels)} {_number(value)}')
+
+            for name in sorted({name for name, labels in self._histograms}):
+                lines += self._header(name, 'histogram')
+                for (key, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if key != name:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{self.namespace}_{name}_bucket{_format(labels + (("le", _number(bound)),))} {count}')
+                    lines.append(f'{self.namespace}_{name}_sum{_format(labels)} {_number(histogram.sum)}')
+                    lines.append(f'{self.namespace}_{name}_count{_format(labels)} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, name, kind):
+        header = [f'# HELP {self.namespace}_{name} {self._help[name]}'] if name in self._help else []
+        return header + [f'# TYPE {self.namespace}_{name} {kind}']
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+class PhaseTimer(object):
+    """
+        Accumulates the time one engine run spends in each of its phases (e.g. path simulation
+        and payoff), then records every phase and the total in the registry with record().
+        Phases entered several times (once per block or per side) add up.
+
+        Attributes:
+        engine : str [engine label]
+        phases : dict [seconds per phase]
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.phases = defaultdict(float)
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def record(self):
+        for name, seconds in self.phases.items():
+            registry.observe('engine_phase_seconds', seconds, engine=self.engine, phase=name)
+        registry.observe('engine_seconds', time.perf_counter() - self.start, engine=self.engine)
+
+class RequestProfiler(object):
+    """
+        Opt-in cProfile of whole requests, switched on and off at runtime: requests are
+        profiled while flag_file exists, so `touch`ing or removing it needs no redeploy.
+        Every profiled request is dumped to out_dir as <timestamp>-<name>.prof, to be read
+        with pstats or snakeviz.
+
+        Attributes:
+        flag_file : str|None [path whose existence enables profiling, None disables it]
+        out_dir : str [directory of the dumps]
+    """
+    def __init__(self, flag_file=None, out_dir='profiles'):
+        self.flag_file = flag_file
+        self.out_dir = out_dir
+
+    @property
+    def enabled(self):
+        return self.flag_file is not None and os.path.exists(self.flag_file)
+
+    def start(self):
+        ''' Returns a running profile, or None when profiling is off'''
+        if not self.enabled:
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile, name):
+        ''' Stops the profile and returns the path of its dump'''
+        profile.disable()
+        os.makedirs(self.out_dir, exist_ok=True)
+        safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name).strip('_') or 'root'
+        path = os.path.join(self.out_dir, f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{safe}.prof")
+        profile.dump_stats(path)
+        return path
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format(labels):
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for key, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+registry = MetricsRegistry()
+registry.describe('request_seconds', 'Latency of the HTTP requests by route, method and status.')
+registry.describe('engine_seconds', 'Wall time of one pricing engine run.')
+registry.describe('engine_phase_seconds', 'Time one engine run spends in each of its phases.')
+registry.describe('iv_solves_total', 'Implied volatility quotes solved.')
+registry.describe('iv_iterations_total', 'Root-finding iterations spent on implied volatilities.')
+registry.describe('iv_failures_total', 'Implied volatility quotes that did not converge or violate the no-arbitrage bounds.')
@@ -0,0 +1,260 @@
+from datetime import datetime
+import math
+import numpy as np
+from options.bs import BlackScholesChain, BlackScholesIV
+from options.fdm import EuFdm, SCHEMES
+from options.lattice import LatticeOption, TREES, METHODS, check_tree
+from options.monte_carlo import MonteCarloOption
+
+MODELS = ['bs', 'fdm', 'monte-carlo', 'lattice']
+CATEGORIES = ['eu', 'asian', 'lookback']
+GREEKS = ['pathwise', 'bump', None]
+OUTPUTS = ['price', 'delta', 'gamma', 'vega', 'theta', 'rho', 'div_sens', 'iv', 'std_err']
+
+class BatchPricer(object):
+    """
+        This class prices a batch of contracts, mixed across the Black-Scholes, FDM,
+        Monte-Carlo and lattice models, and returns the results as columns (one list per output).
+
+        Every contract is validated once, up front. The Black-Scholes contracts are then
+        priced in one BlackScholesChain pass (plus one BlackScholesIV pass for those with
+        a market price), the FDM contracts sharing a grid are answered from a single EuFdm
+        solve, and identical Monte-Carlo and lattice contracts share one simulation or tree.
+
+        Contract fields (rate, vol and div in %):
+        model : str ['bs', 'fdm', 'monte-carlo' or 'lattice', default 'bs']
+        contract_type : str ['C' or 'P']
+        spot, strike, rate, vol : float
+        dte : float [years to expiry] or exp : str [expiry date, YYYY-MM-DD]
+        div : float [bs and lattice only, default 0]
+        market_price : float [bs only, optional, adds the implied volatility]
+        steps, scheme : int, str [fdm only, default 20 asset steps and 'explicit']
+        category, timesteps, n_sims : str, int, int [monte-carlo only, default 'eu', 252 and 10000]
+        greeks : str|None [monte-carlo only, 'pathwise' (default), 'bump' or null for no greeks]
+        steps, tree, method, american : int, str, str, bool [lattice only, default 500, 'binomial', 'plain' and True, even steps for bbsr]
+
+        Attributes:
+        contracts : list [contracts as received]
+        rows : list [normalized contracts]
+        errors : list [(index, message) of every invalid contract]
+    """
+    MAX_STEPS = 1000
+    MAX_PATHS = 10**6
+    MAX_TREE_STEPS = 10**4
+
+    def __init__(self, contracts):
+        if not isinstance(contracts, list):
+            raise ValueError('contracts must be a list of objects')
+
+        self.contracts = contracts
+        self.rows = []
+        self.errors = []
+
+        for i, contract in enumerate(contracts):
+            try:
+                self.rows.append(self._validate(contract))
+            except (KeyError, TypeError, ValueError) as e:
+                self.errors.append((i, str(e) if not isinstance(e, KeyError) else f'missing field {e}'))
+
+    def _validate(self, contract):
+        ''' Returns the normalized contract, raises on invalid input'''
+        if not isinstance(contract, dict):
+            raise TypeError('contract must be an object')
+
+        row = {
+            'model': contract.get('model', 'bs'),
+            'contract_type': contract['contract_type'],
+            'spot': float(contract['spot']),
+            'strike': float(contract['strike']),
+            'rate': float(contract['rate']),
+            'vol': float(contract['vol']),
+        }
+
+        if row['model'] not in MODELS:
+            raise ValueError(f"unknown model {row['model']!r}")
+        if row['contract_type'] not in ('C', 'P'):
+            raise ValueError("contract_type must be 'C' or 'P'")
+        # JSON accepts NaN and Infinity, which every comparison below would let through
+        for key in ['spot', 'strike', 'rate', 'vol']:
+            if not math.isfinite(row[key]):
+                raise ValueError(f'{key} must be a finite number')
+        if row['spot'] <= 0 or row['strike'] <= 0:
+            raise ValueError('spot and strike must be positive')
+        if row['vol'] <= 0:
+            raise ValueError('vol must be positive')
+
+        if 'dte' in contract:
+            row['dte'] = float(contract['dte'])
+        else:
+            row['dte'] = (datetime.strptime(contract['exp'], '%Y-%m-%d') - datetime.today()).days/252
+        if not math.isfinite(row['dte']):
+            raise ValueError('dte must be a finite number')
+        if row['dte'] <= 0:
+            raise ValueError('the contract has expired')
+
+        if row['model'] == 'bs':
+            row['div'] = self._finite(contract.get('div', 0), 'div')
+            market_price = contract.get('market_price')
+            row['market_price'] = None if market_price is None else self._finite(market_price, 'market_price')
+
+        elif row['model'] == 'fdm':
+            row['steps'] = int(contract.get('steps', 20))
+            row['scheme'] = contract.get('scheme', 'explicit')
+            if not 2 <= row['steps'] <= self.MAX_STEPS:
+                raise ValueError(f'steps must be between 2 and {self.MAX_STEPS}')
+            if row['scheme'] not in SCHEMES:
+                raise ValueError(f"unknown scheme {row['scheme']!r}")
+            if row['spot'] > 2 * row['strike']:
+                raise ValueError('fdm spot must lie on the grid [0, 2 * strike]')
+
+        elif row['model'] == 'monte-carlo':
+            row['category'] = contract.get('category', 'eu')
+            row['timesteps'] = int(contract.get('timesteps', 252))
+            row['n_sims'] = int(contract.get('n_sims', 10000))
+            row['greeks'] = contract.get('greeks', 'pathwise')
+            if row['category'] not in CATEGORIES:
+                raise ValueError(f"unknown category {row['category']!r}")
+            if row['greeks'] not in GREEKS:
+                raise ValueError(f"unknown greeks method {row['greeks']!r}")
+            # The monitoring points span [0, dte], a single point would price the payoff at the spot
+            if not 2 <= row['timesteps'] <= self.MAX_STEPS:
+                raise ValueError(f'timesteps must be between 2 and {self.MAX_STEPS}')
+            if not 1 <= row['n_sims'] <= self.MAX_PATHS:
+                raise ValueError(f'n_sims must be between 1 and {self.MAX_PATHS}')
+            # MonteCarloOption rounds the horizon to 0.01 years
+            if round(row['dte'], 2) == 0:
+                raise ValueError('monte-carlo dte must be at least 0.005 years')
+
+        elif row['model'] == 'lattice':
+            row['div'] = self._finite(contract.get('div', 0), 'div')
+            row['steps'] = int(contract.get('steps', 500))
+            row['tree'] = contract.get('tree', 'binomial')
+            row['method'] = contract.get('method', 'plain')
+            row['american'] = self._flag(contract.get('american', True), 'american')
+            if not 8 <= row['steps'] <= self.MAX_TREE_STEPS:
+                raise ValueError(f'lattice steps must be between 8 and {self.MAX_TREE_STEPS}')
+            if row['tree'] not in TREES:
+                raise ValueError(f"unknown tree {row['tree']!r}")
+            if row['method'] not in METHODS:
+                raise ValueError(f"unknown method {row['method']!r}")
+            check_tree(row['rate'], row['dte'], row['vol'], row['div'], row['steps'], row['tree'], row['method'])
+
+        return row
+
+    @staticmethod
+    def _finite(value, name):
+        ''' Returns value as a finite float, raises on NaN and infinities'''
+        value = float(value)
+        if not math.isfinite(value):
+            raise ValueError(f'{name} must be a finite number')
+        return value
+
+    @staticmethod
+    def _flag(value, name):
+        ''' Returns a JSON boolean, or its text form ('true'/'false') as read from a CSV file, as a bool'''
+        if isinstance(value, str):
+            value = {'true': True, 'false': False}.get(value.strip().lower(), value)
+        if not isinstance(value, (bool, np.bool_)):
+            raise ValueError(f'{name} must be true or false')
+        return bool(value)
+
+    def price(self, start=0, stop=None):
+        ''' Prices rows[start:stop] and returns the outputs as columns: {name: list}'''
+        rows = self.rows[start:stop]
+        columns = {key: np.full(len(rows), np.nan) for key in OUTPUTS}
+
+        groups = {model: [i for i, row in enumerate(rows) if row['model'] == model] for model in MODELS}
+        if groups['bs']:
+            self._price_bs(rows, groups['bs'], columns)
+        if groups['fdm']:
+            self._price_fdm(rows, groups['fdm'], columns)
+        if groups['monte-carlo']:
+            self._price_monte_carlo(rows, groups['monte-carlo'], columns)
+        if groups['lattice']:
+            self._price_lattice(rows, groups['lattice'], columns)
+
+        result = {'offset': start, 'model': [row['model'] for row in rows], 'contract_type': [row['contract_type'] for row in rows]}
+        # NaN is not valid JSON: missing outputs are sent as null
+        result.update({key: [None if not math.isfinite(x) else x for x in values.tolist()] for key, values in columns.items()})
+        return result
+
+    def chunks(self, size=1000):
+        ''' Yields the priced columns of consecutive chunks of at most size rows'''
+        for start in range(0, len(self.rows), size):
+            yield self.price(start, start + size)
+
+    @staticmethod
+    def _price_bs(rows, idx, columns):
+        ''' Prices the Black-Scholes rows in one vectorized pass'''
+        data = {key: np.array([rows[i][key] for i in idx]) for key in ['spot', 'strike', 'rate', 'dte', 'vol', 'div']}
+        is_call = np.array([rows[i]['contract_type'] == 'C' for i in idx])
+        chain = BlackScholesChain(data['spot'], data['strike'], data['rate'], data['dte'], data['vol'], data['div'])
+
+        side = lambda call, put: np.where(is_call, call, put)
+        columns['price'][idx] = side(chain.callPrice, chain.putPrice)
+        columns['delta'][idx] = side(chain.callDelta, chain.putDelta)
+        columns['gamma'][idx] = chain.gamma
+        columns['vega'][idx] = chain.vega
+        columns['theta'][idx] = side(chain.callTheta, chain.putTheta)
+        columns['rho'][idx] = side(chain.callRho, chain.putRho)
+        columns['div_sens'][idx] = side(chain.callDivSens, chain.putDivSens)
+
+        quoted = [k for k, i in enumerate(idx) if rows[i]['market_price'] is not None]
+        if quoted:
+            prices = [rows[idx[k]]['market_price'] for k in quoted]
+            iv = BlackScholesIV(prices, data['spot'][quoted], data['strike'][quoted], data['rate'][quoted], data['dte'][quoted], data['div'][quoted], is_call[quoted])
+            columns['iv'][np.array(idx)[quoted]] = iv.vol
+
+    @staticmethod
+    def _price_fdm(rows, idx, columns):
+        ''' Prices the FDM rows, solving each distinct grid once and reading every spot from it'''
+        grids = {}
+        for i in idx:
+            row = rows[i]
+            grids.setdefault((row['strike'], row['vol'], row['rate'], row['dte'], row['steps'], row['scheme']), []).append(i)
+
+        for (strike, vol, rate, dte, steps, scheme), members in grids.items():
+            sides = {rows[i]['contract_type'] for i in members}
+            option = EuFdm(strike, vol, rate, dte, steps, contract_type=sides.pop() if len(sides) == 1 else None, scheme=scheme)
+
+            for contract_type in ('C', 'P'):
+                group = [i for i in members if rows[i]['contract_type'] == contract_type]
+                if not group:
+                    continue
+                greeks = option.greeks([rows[i]['spot'] for i in group], contract_type)
+                for key in ['price', 'delta', 'gamma', 'theta']:
+                    columns[key][group] = greeks[key]
+
+    @staticmethod
+    def _price_monte_carlo(rows, idx, columns):
+        ''' Prices the Monte-Carlo rows, simulating each distinct contract once'''
+        sims = {}
+        for i in idx:
+            row = rows[i]
+            sims.setdefault((row['spot'], row['strike'], row['rate'], row['vol'], row['dte'], row['timesteps'], row['n_sims'], row['category'], row['greeks']), []).append(i)
+
+        for (spot, strike, rate, vol, dte, timesteps, n_sims, category, greeks), members in sims.items():
+            option = MonteCarloOption(spot, strike, rate, vol, dte, timesteps, n_sims, category, streaming=True, greeks=greeks)
+            for i in members:
+                call = rows[i]['contract_type'] == 'C'
+                columns['price'][i] = option.callPrice if call else option.putPrice
+                columns['std_err'][i] = option.callStdErr if call else option.putStdErr
+                for key, name in [('delta', 'Delta'), ('gamma', 'Gamma'), ('vega', 'Vega')]:
+                    columns[key][i] = getattr(option, f'call{name}' if call else f'put{name}')
+
+    @staticmethod
+    def _price_lattice(rows, idx, columns):
+        ''' Prices the lattice rows, rolling back each distinct tree once'''
+        trees = {}
+        for i in idx:
+            row = rows[i]
+            trees.setdefault((row['spot'], row['strike'], row['rate'], row['dte'], row['vol'], row['div'], row['steps'], row['tree'], row['method'], row['american']), []).append(i)
+
+        for (spot, strike, rate, dte, vol, div, steps, tree, method, american), members in trees.items():
+            sides = {rows[i]['contract_type'] for i in members}
+            option = LatticeOption(spot, strike, rate, dte, vol, div, steps=steps, tree=tree, american=american, method=method,
+                                   contract_type=sides.pop() if len(sides) == 1 else None)
+            for i in members:
+                side = 'call' if rows[i]['contract_type'] == 'C' else 'put'
+                for key in ['price', 'delta', 'gamma', 'theta']:
+                    columns[key][i] = getattr(option, side + key.capitalize())
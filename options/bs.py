@@ -6,7 +6,25 @@
 #
 
 import math
-from utils import pdf, cdf
+import numpy as np
+from utils import pdf, cdf, norm_pdf, norm_cdf
+from metrics import registry
+
+class _lazy(object):
+    ''' An output of BlackScholesOption computed on first access and cached in the slot <name>_'''
+    def __init__(self, compute):
+        self.compute = compute
+        self.slot = compute.__name__ + '_'
+        self.__doc__ = compute.__doc__
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot)
+        if value is None:
+            value = self.compute(obj)
+            setattr(obj, self.slot, value)
+        return value
 
 class BlackScholesOption(object):
     """
@@ -14,161 +32,478 @@ class BlackScholesOption(object):
         It computes the price of the put and the call price for a specific strike,
         using the Black-Scholes model. 
 
+        The outputs (callPrice, putPrice, callDelta, putDelta, callTheta, putTheta, callRho,
+        putRho, callDivSens, putDivSens, vega, gamma) are computed on first access and cached.
+        They share d1, d2 and the discount factors, computed with the inputs, and N(d1), N(d2),
+        n(d1), computed once when first needed. reprice() moves the option to a new spot or
+        volatility in place, so loops over volatilities or spots reuse a single object.
+
         Attributes:
         spot : int|float [underlying asset current price]
         strike : int|float [strike price]
         rate : int|float [interest rate]
         dte : int|float [days to expiry in number of years]
-        vol : int|float [underlying asset volatility]
+        vol : int|float|VolSurface [underlying asset volatility, or a surface looked up at (strike, dte)]
         div : int|float [underlying asset dividend yield]
         mktCallPrice : int|float|None [market price of the call]
         mktPutPrice : int|float|None [market price of the put]
     """
+    OUTPUTS = ['callPrice', 'putPrice', 'callDelta', 'putDelta', 'callTheta', 'putTheta', 'callRho', 'putRho', 'callDivSens', 'putDivSens', 'vega', 'gamma']
+    # Cached values, reset whenever the inputs change
+    _CACHED = tuple(name + '_' for name in OUTPUTS) + ('_Nd1_', '_Nmd1_', '_Nd2_', '_Nmd2_', '_nd1_')
+
+    __slots__ = ('spot', 'strike', 'rate', 'dte', 'vol', 'div', 'mktCallPrice', 'mktPutPrice', '_a_', '_d1_', '_d2_', '_b_', '_c_') + _CACHED
+
     def __init__(self, spot, strike, rate, dte, vol, div=0, mktCallPrice=None, mktPutPrice=None):
+        if strike == 0:
+            raise ZeroDivisionError('The strike price cannot be zero')
+
         self.spot = spot
         self.strike = strike
         self.rate = round(rate / 100, 4)
         self.dte = round(dte, 4)
-        self.vol = round(vol / 100, 4)
+        self.vol = round((vol(strike, dte) if callable(vol) else vol) / 100, 4)
         self.div = round(div / 100, 4)
-        # Utility
-        self._a_ = self.vol * self.dte ** 0.5
         # Call Option market price
         self.mktCallPrice = mktCallPrice
         # Put Option market price
         self.mktPutPrice = mktPutPrice
-        
-        if self.strike == 0:
-            raise ZeroDivisionError('The strike price cannot be zero')
-        else:
-            self._d1_ = (math.log((self.spot/self.strike) + (self.rate - self.div + (self.vol)**2) / 2) * self.dte) / self._a_
-        
-        self._d2_ = self._d1_ - self._a_
+
         self._b_ = math.e ** (-self.rate * self.dte)
         self._c_ = math.e ** (-self.div * self.dte)
-        
-        # The __dict__ attribute
+        self._setup()
+
+    def _setup(self):
+        ''' Computes d1 and d2 from the inputs and drops the cached values'''
+        # Utility
+        self._a_ = self.vol * self.dte ** 0.5
+        if self._a_ == 0:
+            self._d1_ = self._d2_ = None
+        else:
+            self._d1_ = (math.log(self.spot/self.strike) + (self.rate - self.div + self.vol**2 / 2) * self.dte) / self._a_
+            self._d2_ = self._d1_ - self._a_
+
+        for name in self._CACHED:
+            setattr(self, name, None)
+
+    def reprice(self, spot=None, vol=None):
         '''
-            Contains all the attributes defined for the object itself. It maps the attribute name to its value
+            Moves the option to a new spot and/or volatility (in %, or a surface) in place and returns it.
+            The outputs are recomputed on their next access.
         '''
-        for i in ['callPrice', 'putPrice', 'callDelta', 'putDelta', 'callTheta', 'putTheta', 'callRho', 'putRho', 'callDivSens','putDivSens', 'vega', 'gamma']:
-            self.__dict__[i] = None
-            
-            [self.callPrice, self.putPrice] = self._price
-            [self.callDelta, self.putDelta] = self._delta
-            [self.callTheta, self.putTheta] = self._theta
-            [self.callRho, self.putRho] = self._rho
-            [self.callDivSens, self.putDivSens] = self._div_sens
-            self.vega = self._vega
-            self.gamma = self._gamma
-            
+        if spot is not None:
+            self.spot = spot
+        if vol is not None:
+            self.vol = round((vol(self.strike, self.dte) if callable(vol) else vol) / 100, 4)
+        self._setup()
+        return self
+
+    # Shared intermediates
+    @_lazy
+    def _Nd1(self):
+        return cdf(self._d1_)
+
+    @_lazy
+    def _Nmd1(self):
+        return cdf(-self._d1_)
+
+    @_lazy
+    def _Nd2(self):
+        return cdf(self._d2_)
+
+    @_lazy
+    def _Nmd2(self):
+        return cdf(-self._d2_)
+
+    @_lazy
+    def _nd1(self):
+        return pdf(self._d1_)
+
     # Option Price
-    @property
-    def _price(self):
-        ''' Returns the option price: [Call price, Put price]'''
-        if self.vol == 0 or self.dte == 0:
-            call = max(0.0, self.spot - self.strike)
-            call = max(0.0, self.strike - self.spot)
-        else:
-            call = self.spot * self._c_ * cdf(self._d1_) - self.strike * self._b_ * cdf(self._d2_)
-            put = self.strike * self._b_ * cdf(-self._d2_) - self.spot * self._c_ * cdf(-self._d1_)
+    @_lazy
+    def callPrice(self):
+        ''' Returns the call price'''
+        if self._a_ == 0:
+            return max(0.0, self.spot - self.strike)
+        return self.spot * self._c_ * self._Nd1 - self.strike * self._b_ * self._Nd2
 
-        return [call, put]
+    @_lazy
+    def putPrice(self):
+        ''' Returns the put price'''
+        if self._a_ == 0:
+            return max(0.0, self.strike - self.spot)
+        return self.strike * self._b_ * self._Nmd2 - self.spot * self._c_ * self._Nmd1
 
     # Option Delta
-    @property
-    def _delta(self):
-        ''' Returns the option delta: [Call delta, Put delta]'''
-        if self.vol == 0 or self.dte == 0:
-            call = 1.0  if self.spot > self.strike else 0.0
-            put = -1.0 if self.spot < self.strike else 0.0
+    @_lazy
+    def callDelta(self):
+        ''' Returns the call delta'''
+        if self._a_ == 0:
+            return 1.0 if self.spot > self.strike else 0.0
+        return self._c_ * self._Nd1
 
-        else:
-            call = self._c_ * cdf(self._d1_)
-            put = -self._c_ * cdf(-self._d1_)
-
-        return [call, put]
+    @_lazy
+    def putDelta(self):
+        ''' Returns the put delta'''
+        if self._a_ == 0:
+            return -1.0 if self.spot < self.strike else 0.0
+        return -self._c_ * self._Nmd1
 
     # Option Gamma
-    @property
-    def _gamma(self):
+    @_lazy
+    def gamma(self):
         ''' Returns the option gamma'''
-        return self._c_ * pdf(self._d1_) / (self.spot * self._a_)
+        if self._a_ == 0:
+            return 0.0
+        return self._c_ * self._nd1 / (self.spot * self._a_)
 
     # Option Vega
-    @property
-    def _vega(self):
+    @_lazy
+    def vega(self):
         ''' Returns the option vega'''
-        if self.vol == 0 or self.dte == 0:
+        if self._a_ == 0:
             return 0.0
-        else:
-            return self.spot * self._c_ * pdf(self._d1_) * self.dte**0.5 / 100
+        return self.spot * self._c_ * self._nd1 * self.dte**0.5 / 100
 
     # Option Theta
-    @property
-    def _theta(self):
-        ''' Returns the option theta: [Call theta, Put theta]'''
-        call =  (-1 * (self._c_ * self.spot * pdf(self._d1_) * self.vol) / (2*self.dte**0.5)) + (self.div * self.spot * self._c_) - (self.rate * self.strike * self._b_ * cdf(self._d2_))
-        put = (-1 * (self._c_ * -self.spot * pdf(self._d1_) * self.vol) / (2*self.dte**0.5)) - (self.div * self.spot * self._c_) + (self.rate * self.strike * self._b_ * cdf(self._d2_))
+    @_lazy
+    def callTheta(self):
+        ''' Returns the call theta'''
+        if self._a_ == 0:
+            return 0.0
+        call = (-1 * (self._c_ * self.spot * self._nd1 * self.vol) / (2*self.dte**0.5)) + (self.div * self.spot * self._c_ * self._Nd1) - (self.rate * self.strike * self._b_ * self._Nd2)
+        return call / 365
 
-        return [call / 365, put / 365]
+    @_lazy
+    def putTheta(self):
+        ''' Returns the put theta'''
+        if self._a_ == 0:
+            return 0.0
+        put = (-1 * (self._c_ * self.spot * self._nd1 * self.vol) / (2*self.dte**0.5)) - (self.div * self.spot * self._c_ * self._Nmd1) + (self.rate * self.strike * self._b_ * self._Nmd2)
+        return put / 365
 
     # Option Rho
-    @property
-    def _rho(self):
-        ''' Returns the option rho: [Call rho, Put rho]'''
-        call = self.strike * self.dte * self._b_ * cdf(self._d2_) / 100
-        put = -self.strike * self.dte * self._b_ * cdf(-self._d2_) / 100
+    @_lazy
+    def callRho(self):
+        ''' Returns the call rho'''
+        if self._a_ == 0:
+            return 0.0
+        return self.strike * self.dte * self._b_ * self._Nd2 / 100
 
-        return [call, put]
+    @_lazy
+    def putRho(self):
+        ''' Returns the put rho'''
+        if self._a_ == 0:
+            return 0.0
+        return -self.strike * self.dte * self._b_ * self._Nmd2 / 100
 
-    @property
-    def _div_sens(self):
-        ''' Returns the option sensitivity to the dividend yield: [Call div_sens, Put div_sens]'''
-        call = -self.dte * self.spot * self._c_ * cdf(self._d1_)
-        put = self.dte * self.spot * self._c_ * cdf(-self._d1_)
+    @_lazy
+    def callDivSens(self):
+        ''' Returns the call sensitivity to the dividend yield'''
+        if self._a_ == 0:
+            return 0.0
+        return -self.dte * self.spot * self._c_ * self._Nd1
 
-        return [call, put]
+    @_lazy
+    def putDivSens(self):
+        ''' Returns the put sensitivity to the dividend yield'''
+        if self._a_ == 0:
+            return 0.0
+        return self.dte * self.spot * self._c_ * self._Nmd1
 
     def callImpliedVol(self):
-        '''Derive the implied volatility for calls using the bisection method'''
+        '''Derive the implied volatility for calls using the Newton/Halley solver'''
         if self.mktCallPrice is None:
             return self.vol
         else:
-            iv = self._bisection_iv(_type='call')
+            iv = self._solve_iv(self.mktCallPrice, 'C')
             return iv
     
     def putImpliedVol(self):
-        '''Derive the implied volatility for puts using the bisection method'''
+        '''Derive the implied volatility for puts using the Newton/Halley solver'''
         if self.mktPutPrice is None:
             return self.vol
         else:
-            iv = self._bisection_iv(_type='put')
+            iv = self._solve_iv(self.mktPutPrice, 'P')
             return iv
-    
-    def _bisection_iv(self, high=500.0, low=0.0, tolerance=1e-7, _type='call'):
-        for i in range(1000):
-            mid = (high+low) / 2
-            if mid < tolerance:
-                mid = tolerance
-
-            if _type == 'call':
-                price = self.mktCallPrice
-                estimate = eval(self.__class__.__name__)(self.spot, self.strike, self.rate, self.dte, mid, self.div).callPrice
-            
-            if _type == 'put':
-                price = self.mktPutPrice
-                estimate = eval(self.__class__.__name__)(self.spot, self.strike, self.rate, self.dte, mid, self.div).putPrice
-            
-            if round(estimate, 6) == price:
-                break
-            elif estimate > price:
-                high = mid
-            elif estimate < price:
-                low = mid
-                
-        return mid
+
+    def _solve_iv(self, price, contract_type):
+        iv = BlackScholesIV(price, self.spot, self.strike, self.rate * 100, self.dte, self.div * 100, contract_type)
+        return float(iv.vol[()])
     
     def __str__(self) -> str:
         return f'Option[Spot={self.spot}, Strike={self.strike}, Rate={self.rate}, DTE={self.dte}, Vol={self.vol}, Div={self.div}, MktCallPrice={self.mktCallPrice}, MktPutPrice={self.mktPutPrice}]'
 
+
+
+class BlackScholesChain(object):
+    """
+        Vectorized counterpart of BlackScholesOption.
+        It prices a whole chain of Vanilla European options on stocks with dividends
+        in a single NumPy pass and exposes the prices and greeks as columnar arrays.
+
+        The inputs are broadcast against each other, so e.g. a column of strikes
+        and a row of expiries price the full strike x expiry grid at once.
+        Units are the same as for BlackScholesOption (rate, vol and div in %).
+
+        Attributes:
+        spot : float|array_like [underlying asset current price]
+        strike : float|array_like [strike price]
+        rate : float|array_like [interest rate]
+        dte : float|array_like [days to expiry in number of years]
+        vol : float|array_like|VolSurface [underlying asset volatility, or a surface looked up at (strike, dte)]
+        div : float|array_like [underlying asset dividend yield]
+    """
+    OUTPUTS = ['callPrice', 'putPrice', 'callDelta', 'putDelta', 'callTheta', 'putTheta', 'callRho', 'putRho', 'callDivSens', 'putDivSens', 'vega', 'gamma']
+
+    def __init__(self, spot, strike, rate, dte, vol, div=0):
+        if callable(vol):
+            vol = vol(*np.broadcast_arrays(np.asarray(strike, dtype=float), np.asarray(dte, dtype=float)))
+        spot, strike, rate, dte, vol, div = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (spot, strike, rate, dte, vol, div)])
+
+        if np.any(strike == 0):
+            raise ZeroDivisionError('The strike price cannot be zero')
+
+        self.spot = spot
+        self.strike = strike
+        self.rate = np.round(rate / 100, 4)
+        self.dte = np.round(dte, 4)
+        self.vol = np.round(vol / 100, 4)
+        self.div = np.round(div / 100, 4)
+        self.shape = self.spot.shape
+
+        with registry.timer('engine_seconds', engine='bs_chain'):
+            self._compute()
+
+    def _compute(self):
+        S, K, r, T, v, q = self.spot, self.strike, self.rate, self.dte, self.vol, self.div
+
+        # Contracts with no volatility or no time left are priced at intrinsic value
+        live = (v != 0) & (T != 0)
+        sqrt_T = np.sqrt(T)
+        a = np.where(live, v * sqrt_T, 1.0)
+        sqrt_T = np.where(live, sqrt_T, 1.0)
+
+        d1 = (np.log(S / K) + (r - q + v**2 / 2) * T) / a
+        d2 = d1 - a
+        b = np.exp(-r * T)
+        c = np.exp(-q * T)
+
+        Nd1, Nd2 = norm_cdf(d1), norm_cdf(d2)
+        Nmd1, Nmd2 = 1 - Nd1, 1 - Nd2
+        nd1 = norm_pdf(d1)
+
+        call = S * c * Nd1 - K * b * Nd2
+        put = K * b * Nmd2 - S * c * Nmd1
+        self.callPrice = np.where(live, call, np.maximum(0.0, S - K))
+        self.putPrice = np.where(live, put, np.maximum(0.0, K - S))
+
+        self.callDelta = np.where(live, c * Nd1, np.where(S > K, 1.0, 0.0))
+        self.putDelta = np.where(live, -c * Nmd1, np.where(S < K, -1.0, 0.0))
+
+        self.gamma = np.where(live, c * nd1 / (S * a), 0.0)
+        self.vega = np.where(live, S * c * nd1 * sqrt_T / 100, 0.0)
+
+        decay = -(c * S * nd1 * v) / (2 * sqrt_T)
+        self.callTheta = np.where(live, (decay + q * S * c * Nd1 - r * K * b * Nd2) / 365, 0.0)
+        self.putTheta = np.where(live, (decay - q * S * c * Nmd1 + r * K * b * Nmd2) / 365, 0.0)
+
+        self.callRho = np.where(live, K * T * b * Nd2 / 100, 0.0)
+        self.putRho = np.where(live, -K * T * b * Nmd2 / 100, 0.0)
+
+        self.callDivSens = np.where(live, -T * S * c * Nd1, 0.0)
+        self.putDivSens = np.where(live, T * S * c * Nmd1, 0.0)
+
+    def to_dict(self):
+        ''' Returns the chain as flat columns: {name: ndarray} for the inputs and every output'''
+        columns = {key: getattr(self, key).ravel() for key in ['spot', 'strike', 'rate', 'dte', 'vol', 'div']}
+        columns.update({key: getattr(self, key).ravel() for key in self.OUTPUTS})
+        return columns
+
+    def __len__(self):
+        return self.spot.size
+
+    def __str__(self) -> str:
+        return f'OptionChain[Contracts={self.spot.size}, Shape={self.shape}]'
+
+
+class BlackScholesIV(object):
+    """
+        Vectorized implied volatility solver for Vanilla European options on stocks with dividends.
+        Calls and puts can be mixed freely; every quote is solved in the same NumPy pass.
+
+        Each quote is mapped to its out-of-the-money side through put-call parity, seeded with
+        the Corrado-Miller rational approximation and refined with Halley steps on vega.
+        A per-quote [low, high] bracket is kept up to date and a bisection step is taken
+        whenever the Halley step would leave it, so the iteration cannot diverge.
+
+        Inputs are in the same units as BlackScholesOption (rate, vol and div in %),
+        and the solved volatilities are returned in % as well.
+
+        Attributes:
+        price : float|array_like [option market price]
+        spot : float|array_like [underlying asset current price]
+        strike : float|array_like [strike price]
+        rate : float|array_like [interest rate]
+        dte : float|array_like [days to expiry in number of years]
+        div : float|array_like [underlying asset dividend yield]
+        contract_type : str|bool|array_like ['C'/'P' or True for calls]
+        vol : ndarray [implied volatility, NaN when the price violates the no-arbitrage bounds]
+        converged : ndarray [True where the solver met the tolerance]
+        iterations : ndarray [# of iterations used per quote]
+    """
+    def __init__(self, price, spot, strike, rate, dte, div=0, contract_type='C', tolerance=1e-10, max_iter=100, high=500.0):
+        is_call = np.asarray(contract_type)
+        if is_call.dtype.kind in 'US':
+            is_call = np.char.upper(is_call) == 'C'
+
+        price, spot, strike, rate, dte, div, is_call = np.broadcast_arrays(
+            *[np.asarray(x, dtype=float) for x in (price, spot, strike, rate, dte, div)], is_call.astype(bool))
+
+        if np.any(strike == 0):
+            raise ZeroDivisionError('The strike price cannot be zero')
+
+        self.price = price
+        self.spot = spot
+        self.strike = strike
+        self.rate = np.round(rate / 100, 4)
+        self.dte = np.round(dte, 4)
+        self.div = np.round(div / 100, 4)
+        self.is_call = is_call
+        self.tolerance = tolerance
+        self.max_iter = max_iter
+        self.high = high / 100
+
+        with registry.timer('engine_seconds', engine='iv'):
+            self.vol, self.converged, self.iterations = self._solve()
+
+        registry.inc('iv_solves_total', self.price.size)
+        registry.inc('iv_iterations_total', int(self.iterations.sum()))
+        registry.inc('iv_failures_total', int(self.price.size - self.converged.sum()))
+
+    def _solve(self):
+        shape = self.price.shape
+        P, S, K, r, T, q = [x.ravel() for x in (self.price, self.spot, self.strike, self.rate, self.dte, self.div)]
+        is_call = self.is_call.ravel()
+
+        vol = np.full(P.size, np.nan)
+        converged = np.zeros(P.size, dtype=bool)
+        iterations = np.zeros(P.size, dtype=int)
+
+        Sc = S * np.exp(-q * T)
+        Kb = K * np.exp(-r * T)
+
+        # Map every quote to its out-of-the-money side: phi = 1 for calls, -1 for puts
+        phi = np.where(K >= Sc / np.exp(-r * T), 1.0, -1.0)
+        parity = np.where(is_call, 1.0, -1.0) * (Sc - Kb)
+        otm = np.where((phi == 1) == is_call, P, P - parity)
+        # Parity can leave round-off noise just below zero for deep in-the-money quotes
+        otm = np.where((otm < 0) & (otm >= -self.tolerance * np.maximum(P, 1.0)), 0.0, otm)
+
+        # No-arbitrage bounds of the out-of-the-money option
+        upper = np.where(phi == 1, Sc, Kb)
+        valid = (T > 0) & (otm >= 0) & (otm < upper)
+        # A worthless out-of-the-money option has zero implied volatility
+        zero = valid & (otm == 0)
+        vol[zero] = 0.0
+        converged[zero] = True
+
+        idx = np.flatnonzero(valid & ~zero)
+        if idx.size == 0:
+            return vol.reshape(shape), converged.reshape(shape), iterations.reshape(shape)
+
+        P, Sc, Kb, T, phi = otm[idx], Sc[idx], Kb[idx], T[idx], phi[idx]
+        sqrt_T = np.sqrt(T)
+        log_m = np.log(Sc / Kb)
+
+        def price_vega(sigma, j=slice(None)):
+            a = sigma * sqrt_T[j]
+            d1 = log_m[j] / a + a / 2
+            d2 = d1 - a
+            value = phi[j] * (Sc[j] * norm_cdf(phi[j] * d1) - Kb[j] * norm_cdf(phi[j] * d2))
+            vega = Sc[j] * norm_pdf(d1) * sqrt_T[j]
+            return value, vega, d1, d2
+
+        # Corrado-Miller initial guess, expressed on the call side via parity
+        call = np.where(phi == 1, P, P + Sc - Kb)
+        half = call - (Sc - Kb) / 2
+        root = np.sqrt(np.maximum(half**2 - (Sc - Kb)**2 / np.pi, 0.0))
+        sigma = math.sqrt(2 * math.pi) / (Sc + Kb) * (half + root) / sqrt_T
+        sigma = np.clip(np.nan_to_num(sigma, nan=0.2), 1e-4, self.high)
+
+        low = np.zeros(idx.size)
+        high = np.full(idx.size, self.high)
+
+        # Prices above the upper bracket have no solution in [0, high]
+        top, _, _, _ = price_vega(high)
+        solvable = P <= top
+
+        active = np.flatnonzero(solvable)
+        n_iter = np.zeros(idx.size, dtype=int)
+        done = np.zeros(idx.size, dtype=bool)
+
+        for i in range(self.max_iter):
+            if active.size == 0:
+                break
+
+            s = sigma[active]
+            value, vega, d1, d2 = price_vega(s, active)
+            diff = value - P[active]
+            n_iter[active] += 1
+
+            # Tighten the bracket: the price is increasing in vol
+            above = diff > 0
+            high[active] = np.where(above, s, high[active])
+            low[active] = np.where(above, low[active], s)
+
+            ok = np.abs(diff) <= self.tolerance * np.maximum(P[active], 1.0)
+            done[active[ok]] = True
+
+            # Halley step on vega (volga = vega * d1 * d2 / sigma)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                newton = diff / vega
+                step = newton / (1 - 0.5 * newton * d1 * d2 / s)
+                new = s - step
+
+            lo, hi = low[active], high[active]
+            outside = ~np.isfinite(new) | (new <= lo) | (new >= hi)
+            new = np.where(outside, (lo + hi) / 2, new)
+
+            small = np.abs(new - s) <= self.tolerance * np.maximum(s, 1e-8)
+            done[active[small & ~ok]] = True
+            sigma[active] = np.where(ok, s, new)
+
+            active = active[~(ok | small)]
+
+        vol[idx] = np.where(solvable, sigma, np.nan) * 100
+        converged[idx] = done
+        iterations[idx] = n_iter
+
+        return vol.reshape(shape), converged.reshape(shape), iterations.reshape(shape)
+
+    def __len__(self):
+        return self.price.size
+
+    def __str__(self) -> str:
+        return f'ImpliedVol[Quotes={self.price.size}, Converged={int(self.converged.sum())}]'
+
+
+def bs_price(spot, strike, rate, dte, vol, div, phi):
+    '''
+        Returns the Black-Scholes prices of broadcast inputs, with phi = 1 for calls and -1 for puts.
+        Unlike the classes above, rate, vol and div are fractions, not %, and nothing is rounded.
+        The intermediates keep the shape of their own inputs, so a grid of inputs only pays full
+        size for d1, d2 and the cdfs. Contracts with no volatility or no time left are worth their intrinsic value.
+    '''
+    a = vol * np.sqrt(dte)
+    live = a > 0
+    if not np.all(live):
+        a = np.where(live, a, 1.0)
+
+    d1 = (np.log(spot / strike) + (rate - div + vol**2 / 2) * dte) / a
+    d2 = d1 - a
+    price = phi * (spot * np.exp(-div * dte) * norm_cdf(phi * d1) - strike * np.exp(-rate * dte) * norm_cdf(phi * d2))
+
+    if not np.all(live):
+        price = np.where(live, price, np.maximum(phi * (spot - strike), 0.0))
+    return price
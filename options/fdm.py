@@ -1,77 +1,332 @@
+import time
 import numpy as np
-import pandas as pd
+from options.bs import BlackScholesOption
+from metrics import PhaseTimer
+
+SCHEMES = {'explicit': 0.0, 'implicit': 1.0, 'crank-nicolson': 0.5}
 
 class EuFdm(object):
     """
         This class abstracts Vanilla European options on stocks with no dividends.
         It computes the price of the put and the call price for a specific strike,
-        using an explicit finite difference scheme. 
+        using an explicit, fully implicit or Crank-Nicolson finite difference scheme.
         It also computes some greeks (delta, gamma, theta) and the implied volatility of the option.
-        
+
+        The greeks are taken by finite differences on the solved grid, and prices and greeks
+        can be read at any spot inside the grid. The last two time layers of every solved side
+        are cached, so value() and greeks() answer a whole spot ladder off a single solve.
+
+        Each run records its wall time and the time spent stepping the grid and taking the
+        greeks in the metrics registry.
+
+        The explicit scheme picks its number of time steps from the stability limit
+        (dt = 0.9 / vol**2 / NAS**2), so a larger NTS is the only accepted override.
+        The implicit and Crank-Nicolson schemes are unconditionally stable and solve one
+        tridiagonal system per time step, so NTS can be chosen freely (default: NAS).
+        Crank-Nicolson starts with two fully implicit steps (Rannacher smoothing) to damp
+        the oscillations caused by the kink of the payoff at the strike.
+
+        Only the side(s) selected by contract_type are solved. The time stepping keeps
+        just the current and previous time layers unless full_grid is set, in which case
+        the whole (S, t) surface is kept in calls_grid/puts_grid as a DataFrame.
+
         Attributes:
         strike : int|float [strike price]
-        vol : float [underlying asset volatility]
+        spot : int|float|None [underlying asset current price, defaults to the strike]
+        vol : float|VolSurface [underlying asset volatility, or a surface looked up at (strike, dte)]
         rate : float [interest rate]
         dte : int|float [days to expiry in number of years]
         NAS : int [# of asset steps]
+        scheme : str ['explicit', 'implicit' or 'crank-nicolson']
+        NTS : int|None [# of time steps]
+        contract_type : str|None ['C' for calls, 'P' for puts, None for both]
+        full_grid : bool [keep the full (S, t) surface]
+        progress : callable|None [called as progress(time steps done, total time steps) while stepping]
         mktCallPrice : float [market price of the call]
         mktPutPrice : float [market price of the put]
     """
-    def __init__(self, strike, vol, rate, dte, NAS=20):
+    def __init__(self, strike, vol, rate, dte, NAS=20, contract_type=None, full_grid=False, scheme='explicit', NTS=None, spot=None, progress=None):
+        if scheme not in SCHEMES:
+            raise ValueError(f'Unknown scheme {scheme!r}, expected one of {list(SCHEMES)}')
+
         self.strike = strike
-        self.vol = round(vol/100, 4)
+        self.spot = strike if spot is None else spot
+        self.vol = round((vol(strike, dte) if callable(vol) else vol)/100, 4)
         self.rate = round(rate/100, 4)
         self.dte = round(dte, 4)
         self.NAS = NAS
-        self.calls_grid = self._eufdm_grid(1)
-        self.puts_grid = self._eufdm_grid(-1)
+        self.scheme = scheme
+        self.NTS = NTS
+        self.contract_type = contract_type
+        self.full_grid = full_grid
+        self.progress = progress
+        self._steps_done = 0
+        self.calls_grid = None
+        self.puts_grid = None
+        self._nodes = {}
+        self._timer = PhaseTimer('fdm')
 
         # The __dict__ attribute
         '''
             Contains all the attributes defined for the object itself. It maps the attribute name to its value
         '''
-        for i in ['callPrice', 'putPrice']:
+        for i in ['callPrice', 'putPrice', 'callDelta', 'putDelta', 'callGamma', 'putGamma', 'callTheta', 'putTheta']:
             self.__dict__[i] = None
-            
-            [self.callPrice, self.putPrice] = self._price
 
-    @property
-    def _price(self):
-        call = self.calls_grid.loc[self.strike, self.dte]
-        put = self.puts_grid.loc[self.strike, self.dte]
-        return [call, put]
-    
+        if contract_type in (None, 'C'):
+            self.calls_grid = self._solve(1)
+            self.callPrice, self.callDelta, self.callGamma, self.callTheta = self._at_spot('C')
+        if contract_type in (None, 'P'):
+            self.puts_grid = self._solve(-1)
+            self.putPrice, self.putDelta, self.putGamma, self.putTheta = self._at_spot('P')
+        self._timer.record()
+
+    def _solve(self, flag=1):
+        ''' Solves one side, caches its greeks on the asset nodes and returns the full grid (or None)'''
+        with self._timer.phase('grid'):
+            s, t, layers = self._eufdm_grid(flag)
+        with self._timer.phase('greeks'):
+            self._nodes[flag] = self._node_greeks(s, layers[-1], layers[-2], t[-1] - t[-2])
+
+        if not self.full_grid:
+            return None
+
+        # pandas is only needed for the full grid, not on the pricing path
+        import pandas as pd
+        grid = pd.DataFrame(np.stack(layers, axis=1), index=s, columns=np.around(t, 4))
+        return np.around(grid, 2)
+
+    def _at_spot(self, contract_type):
+        ''' Returns the rounded option greeks at the spot: [price, delta, gamma, theta]'''
+        greeks = self.greeks(self.spot, contract_type)
+        return [round(float(greeks['price']), 2), round(float(greeks['delta']), 4), round(float(greeks['gamma']), 4), round(float(greeks['theta']), 4)]
+
+    @staticmethod
+    def _node_greeks(s, today, before, dt):
+        ''' Returns the price and greeks on every asset node: {s, price, delta, gamma, theta}'''
+        ds = s[1] - s[0]
+
+        delta = np.empty_like(today)
+        delta[1:-1] = (today[2:] - today[:-2]) / (2*ds)
+        delta[0] = (today[1] - today[0]) / ds
+        delta[-1] = (today[-1] - today[-2]) / ds
+
+        gamma = np.empty_like(today)
+        gamma[1:-1] = (today[2:] - 2*today[1:-1] + today[:-2]) / (ds**2)
+        gamma[0] = gamma[1]
+        gamma[-1] = 0.0 # linear boundary condition at S = infinity
+
+        # Calendar time theta per day, consistent with BlackScholesOption
+        theta = (before - today) / dt / 365
+
+        return {'s': s, 'price': today, 'delta': delta, 'gamma': gamma, 'theta': theta}
+
+    def greeks(self, spots, contract_type='C'):
+        '''
+            Returns the price, delta, gamma and theta at each spot from the cached solve: {name: ndarray}
+            Prices are interpolated with the local quadratic given by the node delta and gamma,
+            delta follows from the same quadratic, gamma and theta are interpolated linearly.
+        '''
+        flag = 1 if contract_type == 'C' else -1
+        if flag not in self._nodes:
+            raise ValueError(f'The {"call" if flag == 1 else "put"} side was not solved (contract_type={self.contract_type!r})')
+
+        nodes = self._nodes[flag]
+        s = nodes['s']
+        spots = np.asarray(spots, dtype=float)
+        if np.any((spots < s[0]) | (spots > s[-1])):
+            raise ValueError(f'Spots must lie on the grid [{s[0]}, {s[-1]}]')
+
+        ds = s[1] - s[0]
+        i = np.clip(np.rint(spots / ds).astype(int), 0, len(s) - 1)
+        h = spots - s[i]
+
+        return {
+            'price': nodes['price'][i] + nodes['delta'][i] * h + .5 * nodes['gamma'][i] * h**2,
+            'delta': nodes['delta'][i] + nodes['gamma'][i] * h,
+            'gamma': np.interp(spots, s, nodes['gamma']),
+            'theta': np.interp(spots, s, nodes['theta']),
+        }
+
+    def value(self, spots, greek='price', contract_type='C'):
+        ''' Returns a single greek ('price', 'delta', 'gamma' or 'theta') at each spot from the cached solve'''
+        if greek not in ('price', 'delta', 'gamma', 'theta'):
+            raise ValueError(f'Unknown greek {greek!r}')
+        return self.greeks(spots, contract_type)[greek]
+
+    def _time_steps(self):
+        ''' Returns the number of time steps for the selected scheme'''
+        if self.scheme == 'explicit':
+            dt = 0.9 / self.vol**2 / self.NAS**2
+            stable = int(self.dte / dt) + 1
+            return stable if self.NTS is None else max(self.NTS, stable)
+
+        return self.NAS if self.NTS is None else max(int(self.NTS), 1)
 
     def _eufdm_grid(self, flag=1):
         # Specify flag as 1 for calls and -1 for puts
 
         ds = 2 * self.strike / self.NAS
-        dt = 0.9 / self.vol**2 / self.NAS**2
-        
-        NTS = int(self.dte / dt) + 1
-        
+        NTS = self._time_steps()
         dt = self.dte / NTS
-        
-        s = np.arange(0, (self.NAS+1)*ds, ds)
-        t = self.dte -  np.arange(NTS*dt, -dt, -dt)
-        
-        grid = np.zeros((len(s), len(t)))
-        grid = pd.DataFrame(grid, index=s, columns=np.around(t, 4))
-        
+
+        s = np.arange(self.NAS+1) * ds
+        t = self.dte - np.arange(NTS, -1, -1) * dt
+
         # Set boundary condition at expiry
-        grid.loc[:, 0] = abs(np.maximum(flag * (s - self.strike), 0))
-        
-        for k in range(1, len(t)):
-            for i in range(1, len(s)-1):
-                delta = (grid.iloc[i+1, k-1] - grid.iloc[i-1, k-1]) / (2*ds)
-                gamma = (grid.iloc[i+1, k-1] - 2*grid.iloc[i, k-1] + grid.iloc[i-1, k-1]) / (ds**2)
-                theta = (-.5 * self.vol**2 * s[i]**2 * gamma) - (self.rate * s[i] * delta) + (self.rate * grid.iloc[i, k-1])
-                grid.iloc[i, k] = grid.iloc[i, k-1] - theta*dt
+        payoff = abs(np.maximum(flag * (s - self.strike), 0))
+
+        if self.scheme == 'explicit':
+            layers = self._explicit_steps(payoff, s, ds, dt, NTS)
+        else:
+            layers = self._theta_steps(payoff, s, ds, dt, NTS, SCHEMES[self.scheme])
+
+        return s, t, layers
+
+    def _report(self):
+        ''' Reports one more time step to the progress callback, counting every solved side'''
+        self._steps_done += 1
+        if self.progress is not None:
+            sides = 2 if self.contract_type is None else 1
+            self.progress(self._steps_done, sides * self._time_steps())
+
+    def _explicit_steps(self, prev, s, ds, dt, NTS):
+        # Coefficients of the interior nodes do not change between time steps
+        si = s[1:-1]
+        half_vol2_s2 = .5 * self.vol**2 * si**2
+        r_s = self.rate * si
+
+        layers = [prev] if self.full_grid else None
+
+        for k in range(1, NTS+1):
+            curr = np.empty_like(prev)
+
+            delta = (prev[2:] - prev[:-2]) / (2*ds)
+            gamma = (prev[2:] - 2*prev[1:-1] + prev[:-2]) / (ds**2)
+            theta = (-half_vol2_s2 * gamma) - (r_s * delta) + (self.rate * prev[1:-1])
+            curr[1:-1] = prev[1:-1] - theta*dt
 
             # Set boundary condition at S = 0
-            grid.iloc[0, k]  = grid.iloc[0, k-1] * (1-self.rate*dt) # ds = rsdt + sigma*sdx, s = 0, ds = 0
+            curr[0] = prev[0] * (1-self.rate*dt) # ds = rsdt + sigma*sdx, s = 0, ds = 0
 
             # Set boundary condition at S = infinity # gamma = 0, so you can linearly extract
-            grid.iloc[len(s)-1, k] = abs(2 * grid.iloc[len(s)-2, k] - grid.iloc[len(s)-3, k])
+            curr[-1] = abs(2 * curr[-2] - curr[-3])
 
-        return np.around(grid, 2)
+            if self.full_grid:
+                layers.append(curr)
+            before, prev = prev, curr
+            self._report()
+
+        return layers if self.full_grid else [before, prev]
+
+    def _theta_steps(self, prev, s, ds, dt, NTS, theta):
+        # theta = 1 is fully implicit, theta = 0.5 is Crank-Nicolson
+        # Spatial operator on the interior nodes: L V_i = a_i V_i-1 + b_i V_i + c_i V_i+1
+        si = s[1:-1]
+        diffusion = .5 * self.vol**2 * si**2 / ds**2
+        drift = self.rate * si / (2*ds)
+        a = diffusion - drift
+        b = -2 * diffusion - self.rate
+        c = diffusion + drift
+
+        implicit = _thomas_factor(*self._theta_matrix(a, b, c, dt, 1.0))
+        crank = _thomas_factor(*self._theta_matrix(a, b, c, dt, theta)) if theta != 1.0 else implicit
+
+        layers = [prev] if self.full_grid else None
+
+        for k in range(1, NTS+1):
+            # Rannacher smoothing: the first two Crank-Nicolson steps are taken fully implicit
+            th, factor = (1.0, implicit) if k <= 2 else (theta, crank)
+
+            curr = np.empty_like(prev)
+
+            # Set boundary condition at S = 0 (dV/dt = -rV)
+            curr[0] = prev[0] * (1 - (1-th)*self.rate*dt) / (1 + th*self.rate*dt)
+
+            # Explicit part of the step, including the previous boundary values
+            rhs = prev[1:-1].copy()
+            if th != 1.0:
+                rhs += (1-th) * dt * (a*prev[:-2] + b*prev[1:-1] + c*prev[2:])
+            rhs[0] += th * dt * a[0] * curr[0]
+
+            curr[1:-1] = _thomas_solve(factor, rhs)
+
+            # Set boundary condition at S = infinity # gamma = 0, so you can linearly extract
+            curr[-1] = abs(2 * curr[-2] - curr[-3])
+
+            if self.full_grid:
+                layers.append(curr)
+            before, prev = prev, curr
+            self._report()
+
+        return layers if self.full_grid else [before, prev]
+
+    @staticmethod
+    def _theta_matrix(a, b, c, dt, theta):
+        ''' Returns the (lower, diag, upper) bands of I - theta*dt*L with the linear S = infinity boundary folded in'''
+        lower = -theta * dt * a
+        diag = 1 - theta * dt * b
+        upper = -theta * dt * c
+        # V_N = 2 V_N-1 - V_N-2 in the last interior row
+        diag[-1] -= 2 * theta * dt * c[-1]
+        lower[-1] += theta * dt * c[-1]
+        return lower, diag, upper
+
+
+def _thomas_factor(lower, diag, upper):
+    ''' Forward elimination of the Thomas algorithm for a constant tridiagonal matrix: [lower, 1/pivots, reduced upper]'''
+    lower, diag, upper = lower.tolist(), diag.tolist(), upper.tolist()
+    n = len(diag)
+    inv = [0.0] * n
+    cprime = [0.0] * n
+
+    inv[0] = 1 / diag[0]
+    cprime[0] = upper[0] * inv[0]
+    for i in range(1, n):
+        inv[i] = 1 / (diag[i] - lower[i] * cprime[i-1])
+        cprime[i] = upper[i] * inv[i]
+
+    return lower, inv, cprime
+
+def _thomas_solve(factor, rhs):
+    ''' Solves the tridiagonal system for one right-hand side in O(n) using a factor from _thomas_factor'''
+    lower, inv, cprime = factor
+    d = rhs.tolist()
+    n = len(d)
+
+    d[0] = d[0] * inv[0]
+    for i in range(1, n):
+        d[i] = (d[i] - lower[i] * d[i-1]) * inv[i]
+    for i in range(n-2, -1, -1):
+        d[i] -= cprime[i] * d[i+1]
+
+    return np.array(d)
+
+def convergence_report(strike, vol, rate, dte, NAS=(20, 40, 80, 160), schemes=('explicit', 'implicit', 'crank-nicolson'), NTS=None):
+    """
+    Compare every scheme against the closed-form BlackScholesOption prices at the strike.
+    NTS defaults to each scheme's own choice (stability limit for explicit, NAS otherwise).
+    Returns a DataFrame with one row per (scheme, NAS) pair: time steps, unrounded prices,
+    absolute errors and wall-clock seconds.
+    """
+    import pandas as pd
+
+    bs = BlackScholesOption(strike, strike, rate, dte, vol)
+    rows = []
+
+    for scheme in schemes:
+        for nas in NAS:
+            # Both sides are solved once, by the constructor
+            start = time.perf_counter()
+            option = EuFdm(strike, vol, rate, dte, nas, scheme=scheme, NTS=NTS)
+            seconds = time.perf_counter() - start
+            row = {'scheme': scheme, 'NAS': nas, 'NTS': option._time_steps()}
+            for flag, name, exact in [(1, 'call', bs.callPrice), (-1, 'put', bs.putPrice)]:
+                nodes = option._nodes[flag]
+                price = float(np.interp(strike, nodes['s'], nodes['price']))
+                row[f'{name}Price'] = price
+                row[f'{name}Error'] = abs(price - exact)
+            row['seconds'] = seconds
+            rows.append(row)
+
+    return pd.DataFrame(rows)
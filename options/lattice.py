@@ -0,0 +1,199 @@
+import math
+import numpy as np
+from utils import norm_cdf
+from metrics import PhaseTimer
+
+TREES = ['binomial', 'trinomial']
+METHODS = ['plain', 'bbs', 'bbsr']
+
+class LatticeOption(object):
+    """
+        This class prices Vanilla American (or European) options on stocks with dividends
+        on a recombining tree: Cox-Ross-Rubinstein binomial or Boyle trinomial.
+
+        The backward induction is vectorized level by level: every level is one NumPy
+        expression over slices of the next one, and only that level is kept, so the memory
+        is O(steps). The node prices are slices of a single precomputed vector of powers of
+        the up move. Calls on a stock without dividends are never exercised early, so their
+        early exercise check is skipped.
+
+        Dividends are either a continuous yield (div, in % as for BlackScholesOption) or cash
+        amounts paid at given times (dividends=[(time in years, amount), ...]). Cash dividends
+        use the escrowed model: the tree is built on the spot less the present value of the
+        dividends, and that present value is added back on every node where exercise is checked.
+
+        The greeks come from the first levels of the tree: delta and gamma by finite
+        differences over the nodes one (trinomial) or two (binomial) steps in, and theta
+        from the value of the middle node of that level.
+
+        method selects the convergence acceleration:
+        - 'plain': the tree as is, with the usual odd-even oscillation of the binomial prices.
+        - 'bbs': binomial Black-Scholes, the last step is replaced by Black-Scholes prices,
+          which smooths the payoff kink and removes the oscillation.
+        - 'bbsr': bbs with Richardson extrapolation, 2 * P(steps) - P(steps / 2), for prices
+          and greeks, so steps must be even. A few hundred steps then match thousands of plain steps.
+
+        check_tree validates the tree arguments, probabilities included, without rolling it back.
+
+        Attributes:
+        spot : int|float [underlying asset current price]
+        strike : int|float [strike price]
+        rate : float [interest rate]
+        dte : int|float [days to expiry in number of years]
+        vol : float|VolSurface [underlying asset volatility, or a surface looked up at (strike, dte)]
+        div : float [underlying asset dividend yield]
+        dividends : list [(time in years, amount) of the cash dividends]
+        steps : int [# of time steps]
+        tree : str ['binomial' or 'trinomial']
+        american : bool [allow early exercise]
+        method : str ['plain', 'bbs' or 'bbsr']
+        contract_type : str|None ['C' for calls, 'P' for puts, None for both]
+    """
+    def __init__(self, spot, strike, rate, dte, vol, div=0, dividends=None, steps=500, tree='binomial', american=True, method='plain', contract_type=None):
+        vol = vol(strike, dte) if callable(vol) else vol
+        check_tree(rate, dte, vol, div, steps, tree, method)
+        if strike <= 0 or spot <= 0:
+            raise ValueError('spot and strike must be positive')
+
+        self.spot = spot
+        self.strike = strike
+        self.rate = round(rate / 100, 4)
+        self.dte = round(dte, 4)
+        self.vol = round(vol / 100, 4)
+        self.div = round(div / 100, 4)
+        # Only the dividends paid before expiry matter
+        self.dividends = sorted((t, d) for t, d in (dividends or []) if 0 < t <= self.dte)
+        self.steps = steps
+        self.tree = tree
+        self.american = american
+        self.method = method
+        self.contract_type = contract_type
+
+        if self.spot - self._pv_dividends(0.0) <= 0:
+            raise ValueError('The dividends exceed the value of the stock')
+
+        # The __dict__ attribute
+        '''
+            Contains all the attributes defined for the object itself. It maps the attribute name to its value
+        '''
+        for i in ['callPrice', 'putPrice', 'callDelta', 'putDelta', 'callGamma', 'putGamma', 'callTheta', 'putTheta']:
+            self.__dict__[i] = None
+
+        timer = PhaseTimer('lattice')
+        if contract_type in (None, 'C'):
+            with timer.phase('induction'):
+                self.callPrice, self.callDelta, self.callGamma, self.callTheta = self._solve(1)
+        if contract_type in (None, 'P'):
+            with timer.phase('induction'):
+                self.putPrice, self.putDelta, self.putGamma, self.putTheta = self._solve(-1)
+        timer.record()
+
+    def _pv_dividends(self, t):
+        ''' Returns the value at time t of the cash dividends paid after t'''
+        return sum(d * math.exp(-self.rate * (s - t)) for s, d in self.dividends if s > t)
+
+    def _solve(self, flag):
+        ''' Returns [price, delta, gamma, theta] of one side, Richardson-extrapolated for bbsr'''
+        fine = self._induct(flag, self.steps, self.method != 'plain')
+        if self.method != 'bbsr':
+            return fine
+
+        coarse = self._induct(flag, self.steps // 2, True)
+        return [2 * f - c for f, c in zip(fine, coarse)]
+
+    def _induct(self, flag, N, smooth):
+        ''' Rolls the tree back from expiry and returns [price, delta, gamma, theta] (theta per calendar day)'''
+        r, q, v, K = self.rate, self.div, self.vol, self.strike
+        dt = self.dte / N
+        disc = math.exp(-r * dt)
+        trinomial = self.tree == 'trinomial'
+        u, pu, pm, pd = _moves(r, q, v, dt, trinomial)
+
+        # Node prices of the escrowed stock, level i being spots[N-i:N+i+1] (every other node for binomial)
+        stride = 1 if trinomial else 2
+        spots = (self.spot - self._pv_dividends(0.0)) * u ** np.arange(-N, N + 1, dtype=float)
+        level = lambda i: spots[N - i:N + i + 1:stride]
+        escrow = [self._pv_dividends(i * dt) for i in range(N + 1)] if self.dividends else None
+        exercise = self.american and not (flag == 1 and q == 0 and not self.dividends)
+        payoff = flag * (spots - K)
+
+        if smooth:
+            # Binomial Black-Scholes: the last step is priced in closed form
+            first = N - 1
+            V = _bs_values(level(first), K, r, q, v, dt, flag)
+            if exercise:
+                np.maximum(V, payoff[N - first:N + first + 1:stride] + (flag * escrow[first] if escrow else 0), out=V)
+        else:
+            first = N
+            V = np.maximum(payoff[::stride], 0.0)
+
+        cu, cm, cd = disc * pu, disc * pm, disc * pd
+        saved = {first: V}
+        for i in range(first - 1, -1, -1):
+            if trinomial:
+                V = cu * V[2:] + cm * V[1:-1] + cd * V[:-2]
+            else:
+                V = cu * V[1:] + cd * V[:-1]
+            if exercise:
+                intrinsic = payoff[N - i:N + i + 1:stride]
+                if escrow:
+                    intrinsic = intrinsic + flag * escrow[i]
+                np.maximum(V, intrinsic, out=V)
+            if i <= 2:
+                saved[i] = V
+
+        # Greeks from the nodes around the spot, on the actual (not escrowed) stock prices
+        k = 1 if trinomial else 2
+        (Sd, Sm, Su), (Vd, Vm, Vu) = level(k) + (escrow[k] if escrow else 0), saved[k]
+        price = float(saved[0][0])
+        delta = float((Vu - Vd) / (Su - Sd))
+        gamma = float(((Vu - Vm) / (Su - Sm) - (Vm - Vd) / (Sm - Sd)) / ((Su - Sd) / 2))
+        theta = float((Vm - price) / (k * dt) / 365)
+
+        return [price, delta, gamma, theta]
+
+    def __str__(self) -> str:
+        return f'LatticeOption[Spot={self.spot}, Strike={self.strike}, Rate={self.rate}, DTE={self.dte}, Vol={self.vol}, Div={self.div}, Steps={self.steps}, Tree={self.tree}, American={self.american}, Method={self.method}]'
+
+def check_tree(rate, dte, vol, div=0, steps=500, tree='binomial', method='plain'):
+    '''
+        Raises a ValueError if LatticeOption cannot roll the tree back: unknown tree or method, too few steps,
+        odd steps for bbsr, or negative probabilities (rate, vol and div in %, as for LatticeOption)
+    '''
+    if tree not in TREES:
+        raise ValueError(f'Unknown tree {tree!r}, expected one of {TREES}')
+    if method not in METHODS:
+        raise ValueError(f'Unknown method {method!r}, expected one of {METHODS}')
+    if steps < (8 if method == 'bbsr' else 4):
+        raise ValueError(f'The {method} method needs at least {8 if method == "bbsr" else 4} steps')
+    if method == 'bbsr' and steps % 2:
+        raise ValueError('The bbsr method needs an even # of steps')
+
+    r, q, v, T = round(rate / 100, 4), round(div / 100, 4), round(vol / 100, 4), round(dte, 4)
+    if v <= 0 or T <= 0:
+        raise ValueError('vol and dte must be positive')
+    # The carry has to stay within one up or down move per step
+    for N in ([steps, steps // 2] if method == 'bbsr' else [steps]):
+        u, pu, pm, pd = _moves(r, q, v, T / N, tree == 'trinomial')
+        if not (0 < pu < 1 and 0 < pd < 1 and pm >= 0):
+            raise ValueError(f'The tree has negative probabilities with {N} steps, increase steps')
+
+def _moves(r, q, v, dt, trinomial):
+    ''' Returns the up move and the up, middle and down probabilities of one step: [u, pu, pm, pd]'''
+    if trinomial:
+        u = math.exp(v * math.sqrt(2 * dt))
+        a, b = math.exp(v * math.sqrt(dt / 2)), math.exp((r - q) * dt / 2)
+        pu = ((b - 1 / a) / (a - 1 / a)) ** 2
+        pd = ((a - b) / (a - 1 / a)) ** 2
+        return [u, pu, 1 - pu - pd, pd]
+
+    u = math.exp(v * math.sqrt(dt))
+    pu = (math.exp((r - q) * dt) - 1 / u) / (u - 1 / u)
+    return [u, pu, 0.0, 1 - pu]
+
+def _bs_values(S, K, r, q, v, T, flag):
+    ''' Returns the Black-Scholes prices of a vector of spots for one strike and maturity'''
+    a = v * math.sqrt(T)
+    d1 = (np.log(S / K) + (r - q + v**2 / 2) * T) / a
+    d2 = d1 - a
+    return flag * (S * math.exp(-q * T) * norm_cdf(flag * d1) - K * math.exp(-r * T) * norm_cdf(flag * d2))
@@ -1,87 +1,707 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from statistics import NormalDist
+import copy
+import math
 import numpy as np
+from options.bs import BlackScholesOption
+from utils import cdf, norm_ppf
+from metrics import PhaseTimer
 
 class MonteCarloOption(object):
     """
         This class uses Monte-Caro simulation to compute the price of an option.
         It can be used for Vanilla European, Asian and Barrier options.
-        
+
+        The random numbers are laid out in blocks of BLOCK_SIZE paths, each block drawing
+        from its own generator spawned from numpy.random.SeedSequence(seed). The full-matrix
+        run keeps every path in S, while the streaming run (streaming=True) simulates one
+        block at a time and only tracks the statistic the payoff needs (terminal value for
+        eu, running sum for asian, running max/min for lookback), TIME_BLOCK steps at a time,
+        so its memory does not grow with n_sims or timesteps (quasi runs excepted, see below).
+        Both runs give the same prices and standard errors for the same seed.
+
+        With workers > 1 the blocks are streamed in parallel on a thread or process pool.
+        Every block keeps its own spawned stream and the per-block sums are combined in block
+        order, so the results are bit-identical for a given seed whatever the worker count.
+
+        Variance reduction (all opt-in):
+        - antithetic: every normal draw is paired with its negation.
+        - control_variate: the payoff is regressed on a control with a closed-form mean:
+          the terminal price for eu, the geometric-average Asian option for asian and the
+          BlackScholesOption vanilla for lookback.
+        - quasi: Sobol points (random digital shift) drive a Brownian bridge, so the first
+          Sobol dimensions set the coarse shape of the paths. The paths are split into
+          QMC_REPLICATIONS independently shifted replications and the standard error is
+          taken across them. A replication is simulated BLOCK_SIZE paths at a time, on consecutive
+          points of its shifted sequence, so the memory does not grow with n_sims. The bridge of a
+          block is built over all its time steps though, so the memory of a quasi run grows with
+          timesteps: a few (timesteps, BLOCK_SIZE) float64 arrays.
+          Dimensions beyond the Sobol table are padded with pseudo-random normals.
+        Antithetic and quasi runs always stream.
+
+        Paths are stepped over timesteps monitoring points spanning [0, horizon], either with the
+        exact log-normal solution (scheme='exact', exp of cumulative sums of the log increments,
+        TIME_BLOCK steps at a time) or with the Euler update (scheme='euler'). With the exact
+        scheme an eu option only needs the terminal value, so it is simulated in a single step.
+        dtype=np.float32 halves the memory of the stored and streamed paths; payoffs and their
+        sums are always accumulated in float64.
+
+        Every price comes with a standard error and a confidence interval.
+
+        Greeks (opt-in, greeks='pathwise' or 'bump'): delta, gamma and vega (per 1% of vol) of
+        the call and the put, each with a standard error.
+        - pathwise: taken from the same paths as the prices, in the same pass. Every path price is
+          proportional to s0 and, with the exact scheme, its derivative in sigma is
+          S_t * (log(S_t/s0) - (r + sigma^2/2) * t) / sigma, so delta and vega are pathwise
+          derivatives of the payoffs (the average for asian, the price at the extremum for
+          lookback). Gamma is not pathwise, the payoffs having a kink. For eu it uses the
+          likelihood-ratio weight of the first increment on the pathwise delta. The asian average
+          and the lookback extrema also include S0 itself, which that weight misses, so their
+          gamma is the central difference of the payoffs at s0 -/+ BUMP_SPOT * s0, the same paths
+          rescaled (common random numbers without a rerun). The Euler scheme falls back to bump.
+        - bump: central differences of full reruns with the same seed (common random numbers)
+          at s0 -/+ BUMP_SPOT * s0 and sigma -/+ BUMP_VOL. Their standard errors come from the
+          spread of the differences across blocks of paths (NaN with a single block).
+
+        Each run records its wall time and the time spent in its 'paths' and 'payoff' phases
+        in the metrics registry. Parallel blocks add up their phase times, except on process
+        workers whose timings stay in the workers.
+
         Attributes:
         s0 : int|float [underlying asset current price]
         strike : int|float [strike price]
-        sigma : float [underlying asset volatility]
+        sigma : float|VolSurface [underlying asset volatility, or a surface looked up at (K, horizon)]
         r : float [interest rate]
         timesteps : int [# of timesteps]
         horizon : int [time horizon]
         n_sims : int [# of simulations]
         category : str [option category]
+        streaming : bool [simulate block by block instead of keeping the full path matrix]
+        seed : int [seed of the random streams]
+        workers : int [# of parallel workers, implies streaming when > 1]
+        backend : str ['thread' or 'process' pool]
+        antithetic : bool [use antithetic variates]
+        control_variate : bool [use the category's closed-form control variate]
+        quasi : bool [use Sobol points with a Brownian bridge]
+        confidence : float [level of the confidence intervals]
+        scheme : str ['exact' or 'euler' path stepping]
+        dtype : numpy dtype [float64 or float32 path storage]
+        progress : callable|None [called as progress(paths done, n_sims) after each block]
+        greeks : str|None ['pathwise' or 'bump' to compute the greeks, the method used after any fallback]
     """
-    def __init__(self, s0, K, mu, sigma, horizon, timesteps, n_sims, category='eu') -> None:
+    BLOCK_SIZE = 2**14
+    TIME_BLOCK = 64
+    QMC_REPLICATIONS = 16
+    GREEKS = ['callDelta', 'putDelta', 'callGamma', 'putGamma', 'callVega', 'putVega']
+    BUMP_SPOT = 0.01
+    BUMP_VOL = 1.0
+
+    def __init__(self, s0, K, mu, sigma, horizon, timesteps, n_sims, category='eu', streaming=False, seed=2024, workers=1, backend='thread',
+                 antithetic=False, control_variate=False, quasi=False, confidence=0.95, scheme='exact', dtype=np.float64, progress=None, greeks=None) -> None:
+        if category not in ('eu', 'asian', 'lookback'):
+            raise ValueError(f'Unknown option category {category!r}')
+        if backend not in ('thread', 'process'):
+            raise ValueError(f'Unknown backend {backend!r}')
+        if scheme not in ('exact', 'euler'):
+            raise ValueError(f'Unknown scheme {scheme!r}')
+        if np.dtype(dtype) not in (np.float32, np.float64):
+            raise ValueError(f'Unsupported dtype {dtype!r}, expected float32 or float64')
+        if quasi and n_sims < 2 * self.QMC_REPLICATIONS:
+            raise ValueError(f'Quasi-random runs need at least {2 * self.QMC_REPLICATIONS} simulations')
+        if greeks not in (None, 'pathwise', 'bump'):
+            raise ValueError(f"Unknown greeks method {greeks!r}, expected 'pathwise' or 'bump'")
+
         self.s0 = s0
         self.K = K
         self.mu = round(mu/100, 4)
-        self.sigma = round(sigma/100, 4)
+        self.sigma = round((sigma(K, horizon) if callable(sigma) else sigma)/100, 4)
         self.horizon = round(horizon, 2)
         self.timesteps = timesteps
         self.n_sims = n_sims
         self.category = category
-        self.S = self._simulate_path()
+        self.streaming = streaming or workers > 1 or antithetic or quasi
+        self.seed = seed
+        self.workers = workers
+        self.backend = backend
+        self.antithetic = antithetic
+        self.control_variate = control_variate
+        self.quasi = quasi
+        self.confidence = confidence
+        self.scheme = scheme
+        self.dtype = np.dtype(dtype)
+        self.progress = progress
+        # The pathwise vega needs the exact log-normal paths
+        self.greeks = 'bump' if greeks == 'pathwise' and scheme == 'euler' else greeks
+        if self.greeks is not None and (self.sigma <= 0 or self._grid()[0] == 0):
+            raise ValueError('Greeks need a positive volatility and at least 2 timesteps')
+        self._timer = PhaseTimer('monte_carlo')
+        self.S = None if self.streaming else self._simulate_path()
 
         # The __dict__ attribute
         '''
             Contains all the attributes defined for the object itself. It maps the attribute name to its value
         '''
-        for i in ['callPrice', 'putPrice']:
+        for i in ['callPrice', 'putPrice', 'callStdErr', 'putStdErr', 'callCI', 'putCI'] + self.GREEKS + [f'{name}StdErr' for name in self.GREEKS]:
             self.__dict__[i] = None
-            
+
+        sums = self._run()
+        [self.callPrice, self.putPrice, self.callStdErr, self.putStdErr] = self._price(sums)
+
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.callCI = (self.callPrice - z * self.callStdErr, self.callPrice + z * self.callStdErr)
+        self.putCI = (self.putPrice - z * self.putStdErr, self.putPrice + z * self.putStdErr)
+
+        if self.greeks is not None:
+            values, errors = self._pathwise_greeks(sums) if self.greeks == 'pathwise' else self._bump_greeks(sums)
+            for name, value, error in zip(self.GREEKS, values, errors):
+                self.__dict__[name] = float(value)
+                self.__dict__[f'{name}StdErr'] = float(error)
+        self._timer.record()
+
+    def _run(self):
+        ''' Simulates the paths and returns the sample sums of every block'''
+        if self.workers > 1:
+            return self._parallel_sums()
+        if self.streaming:
+            return self._stream_sums()
+        return self._matrix_sums()
+
+    def _blocks(self):
+        ''' Returns the (start, stop) path ranges of the random number blocks'''
+        if self.quasi:
+            bounds = np.linspace(0, self.n_sims, self.QMC_REPLICATIONS + 1).astype(int)
+            return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+        starts = range(0, self.n_sims, self.BLOCK_SIZE)
+        return [(start, min(start + self.BLOCK_SIZE, self.n_sims)) for start in starts]
+
+    def _seeds(self):
+        ''' Returns one independent seed sequence per block of paths'''
+        return np.random.SeedSequence(self.seed).spawn(len(self._blocks()))
+
+    def _samples(self, stats):
+        '''
+            Returns the call and put payoffs and their controls (or None), followed by the pathwise greek samples if any:
+            [Call payoffs, Put payoffs, Call controls, Put controls, Call delta, Put delta, Call gamma, Put gamma, Call vega, Put vega]
+        '''
+        if self.category == 'eu':
+            call, put = np.maximum(0, stats['last']-self.K), np.maximum(0, self.K-stats['last'])
+            controls = [stats['last'], stats['last']]
+        elif self.category == 'asian':
+            call, put = np.maximum(0, stats['mean']-self.K), np.maximum(0, self.K-stats['mean'])
+            if self.control_variate:
+                G = np.exp(stats['logmean'])
+                controls = [np.maximum(0, G-self.K), np.maximum(0, self.K-G)]
+        elif self.category == 'lookback':
+            call, put = np.maximum(0, stats['max']-self.K), np.maximum(0, self.K-stats['min'])
+            if self.control_variate:
+                controls = [np.maximum(0, stats['last']-self.K), np.maximum(0, self.K-stats['last'])]
+
+        if not self.control_variate:
+            controls = [None, None]
+
+        if self.greeks != 'pathwise':
+            return [call, put] + controls
+        return [call, put] + controls + self._greek_samples(stats)
+
+    def _greek_samples(self, stats):
+        ''' Returns the undiscounted pathwise greek samples: [Call delta, Put delta, Call gamma, Put gamma, Call vega, Put vega]'''
+        # The payoff statistics and their derivatives in sigma
+        if self.category == 'lookback':
+            high, low, high_sens, low_sens = stats['max'], stats['min'], stats['max_sens'], stats['min_sens']
+        else:
+            high = low = stats['last'] if self.category == 'eu' else stats['mean']
+            high_sens = low_sens = stats['sens']
+        call_itm, put_itm = high > self.K, low < self.K
+
+        # Path prices are proportional to s0
+        call_delta = np.where(call_itm, high / self.s0, 0.0)
+        put_delta = np.where(put_itm, -low / self.s0, 0.0)
+
+        if self.category == 'eu':
+            # Likelihood ratio on the pathwise delta: d/ds0 E[delta] = E[delta * weight] - E[delta] / s0
+            weight = stats['weight'] - 1 / self.s0
+            call_gamma, put_gamma = call_delta * weight, put_delta * weight
+        else:
+            # The payoffs depend on S0 directly: second differences of the payoffs of the rescaled paths
+            h = self.BUMP_SPOT
+            second = lambda payoff: (payoff(1 + h) - 2 * payoff(1) + payoff(1 - h)) / (h * self.s0)**2
+            call_gamma = second(lambda scale: np.maximum(0, scale * high - self.K))
+            put_gamma = second(lambda scale: np.maximum(0, self.K - scale * low))
+
+        call_vega = np.where(call_itm, high_sens, 0.0) / 100
+        put_vega = np.where(put_itm, -low_sens, 0.0) / 100
+
+        return [call_delta, put_delta, call_gamma, put_gamma, call_vega, put_vega]
+
+    @staticmethod
+    def _sums(call, put, call_control=None, put_control=None, *greeks):
+        '''
+            Returns the sufficient statistics of a block of samples:
+            [count, sums of the payoffs, sums of their squares, sums of the controls, sums of their squares, sums of the cross products,
+             then the sum and the sum of squares of every greek sample]
+        '''
+        sums = np.zeros(11 + 2 * len(greeks))
+        sums[0] = call.size
+        sums[1:5] = [call.sum(), put.sum(), np.dot(call, call), np.dot(put, put)]
+        if call_control is not None:
+            sums[5:11] = [call_control.sum(), put_control.sum(), np.dot(call_control, call_control), np.dot(put_control, put_control),
+                          np.dot(call_control, call), np.dot(put_control, put)]
+        for i, x in enumerate(greeks):
+            sums[11 + 2*i:13 + 2*i] = [x.sum(), np.dot(x, x)]
+        return sums
+
+    def _grid(self):
+        ''' Returns the number of simulated steps and their length: [steps, dt]'''
+        if self.timesteps < 2:
+            return [0, 0.0]
+        if self.category == 'eu' and self.scheme == 'exact':
+            # The terminal value is all an eu payoff needs
+            return [1, self.horizon]
+        return [self.timesteps - 1, self.horizon / (self.timesteps - 1)]
+
+    def _control_means(self):
+        ''' Returns the closed-form undiscounted means of the controls: [Call control, Put control]'''
+        r = self.mu
+        steps, dt = self._grid()
+
+        if self.category == 'eu':
+            # Exact mean of the simulated terminal price
+            growth = self.s0 * ((1 + r*dt) ** steps if self.scheme == 'euler' else math.exp(r * dt * steps))
+            return [growth, growth]
+
+        if self.category == 'asian':
+            # Geometric average of the steps+1 monitoring points 0, dt, ..., steps*dt of a geometric Brownian motion
+            m = math.log(self.s0) + (r - self.sigma**2 / 2) * dt * steps / 2
+            v = self.sigma**2 * dt * steps * (2*steps + 1) / (6*(steps + 1))
+            if v == 0:
+                G = math.exp(m)
+                return [max(0.0, G - self.K), max(0.0, self.K - G)]
+            d1 = (m - math.log(self.K) + v) / math.sqrt(v)
+            d2 = d1 - math.sqrt(v)
+            forward = math.exp(m + v/2)
+            return [forward * cdf(d1) - self.K * cdf(d2), self.K * cdf(-d2) - forward * cdf(-d1)]
+
+        # Vanilla European option on the last monitoring point
+        tau = dt * steps
+        if tau == 0 or self.sigma == 0:
+            forward = self.s0 * math.exp(r * tau)
+            return [max(0.0, forward - self.K), max(0.0, self.K - forward)]
+        vanilla = BlackScholesOption(self.s0, self.K, r*100, tau, self.sigma*100)
+        growth = math.exp(vanilla.rate * vanilla.dte)
+        return [vanilla.callPrice * growth, vanilla.putPrice * growth]
+
+    def _estimate(self, totals):
+        ''' Returns the undiscounted means and the variances of the means: [[Call mean, Put mean], [Call variance, Put variance]]'''
+        n = totals[0]
+        mean = totals[1:3] / n
+        var = np.maximum(totals[3:5] - n * mean**2, 0) / max(n - 1, 1)
+
+        if self.control_variate:
+            control = totals[5:7] / n
+            control_var = np.maximum(totals[7:9] - n * control**2, 0) / max(n - 1, 1)
+            cov = (totals[9:11] - n * control * mean) / max(n - 1, 1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                beta = np.where(control_var > 0, cov / control_var, 0.0)
+            mean = mean - beta * (control - np.array(self._control_means()))
+            var = np.maximum(var - beta * cov, 0)
+
+        return [mean, var / n]
+
+    def _price(self, sums):
+        ''' Returns the discounted prices and their standard errors: [Call price, Put price, Call std err, Put std err]'''
+        discount = np.exp(-self.mu*self.horizon)
+
+        if self.quasi:
+            # Each block is an independently shifted replication: the error comes from their spread
+            estimates = np.array([self._estimate(block)[0] for block in sums])
+            mean = estimates.mean(axis=0)
+            se = estimates.std(axis=0, ddof=1) / np.sqrt(len(estimates))
+        else:
+            totals = np.zeros(len(sums[0]))
+
+            # Combine the blocks in order so that the result does not depend on how they were scheduled
+            for block in sums:
+                totals += block
+
+            mean, var = self._estimate(totals)
+            se = np.sqrt(var)
+
+        call, put = discount * mean
+        call_se, put_se = discount * se
+
+        return [call, put, call_se, put_se]
+
+    def _pathwise_greeks(self, sums):
+        ''' Returns the discounted greeks from the pathwise samples and their standard errors: [[greeks], [std errs]]'''
+        discount = np.exp(-self.mu*self.horizon)
+        blocks = np.array(sums)
+
+        if self.quasi:
+            estimates = blocks[:, 11::2] / blocks[:, :1]
+            mean = estimates.mean(axis=0)
+            se = estimates.std(axis=0, ddof=1) / np.sqrt(len(estimates))
+        else:
+            totals = np.zeros(blocks.shape[1])
+            for block in blocks:
+                totals += block
+            n = totals[0]
+            mean = totals[11::2] / n
+            se = np.sqrt(np.maximum(totals[12::2] - n * mean**2, 0) / max(n - 1, 1) / n)
+
+        return [discount * mean, discount * se]
+
+    def _bump_greeks(self, sums):
+        ''' Returns the greeks from reruns with the same random numbers at bumped s0 and sigma, and their standard errors: [[greeks], [std errs]]'''
+        ds = self.BUMP_SPOT * self.s0
+        dv = min(self.BUMP_VOL, self.sigma * 100 / 2) / 100
+
+        def rerun(s0, sigma):
+            # A streaming copy draws the same numbers as the matrix run for the same seed
+            option = copy.copy(self)
+            option.s0, option.sigma = s0, sigma
+            option.streaming, option.S, option.progress, option.greeks = True, None, None, None
+            return option._block_prices(option._run())
+
+        base = self._block_prices(sums)
+        up, down = rerun(self.s0 + ds, self.sigma), rerun(self.s0 - ds, self.sigma)
+        vol_up, vol_down = rerun(self.s0, self.sigma + dv), rerun(self.s0, self.sigma - dv)
+
+        # (blocks + 1, 2): the differences of the pooled prices, then of every block
+        delta = (up - down) / (2 * ds)
+        gamma = (up - 2 * base + down) / ds**2
+        vega = (vol_up - vol_down) / (2 * dv * 100)
+
+        values, errors = [], []
+        for greek in (delta, gamma, vega):
+            values.extend(greek[0])
+            blocks = greek[1:]
+            errors.extend(blocks.std(axis=0, ddof=1) / np.sqrt(len(blocks)) if len(blocks) > 1 else [np.nan, np.nan])
+        return [values, errors]
+
+    def _block_prices(self, sums):
+        ''' Returns the call and put prices of all the paths, then of every block: (blocks + 1, 2) array'''
+        discount = np.exp(-self.mu*self.horizon)
+        pooled = self._price(sums)[:2]
+        return np.array([pooled] + [discount * self._estimate(block)[0] for block in sums])
+
+    def _matrix_sums(self):
+        ''' Returns the sample sums of the full path matrix, block by block'''
+        S = self.S
+        with self._timer.phase('paths'):
+            stats = self._new_stats(S[0])
+            for i in range(1, len(S), self.TIME_BLOCK):
+                self._update_stats(stats, S[i:i+self.TIME_BLOCK])
+            stats = self._final_stats(stats, S[-1])
+
+        sums = []
+        with self._timer.phase('payoff'):
+            for start, stop in self._blocks():
+                sums.append(self._sums(*self._samples({key: value[start:stop] for key, value in stats.items()})))
+        return sums
+
+    def _report(self, done):
+        if self.progress is not None:
+            self.progress(done, self.n_sims)
+
+    def _stream_sums(self):
+        ''' Returns the sample sums of each block, simulated one after the other'''
+        sums = []
+        for (start, stop), seed in zip(self._blocks(), self._seeds()):
+            sums.append(self._block_sums(start, stop, seed))
+            self._report(stop)
+        return sums
+
+    def _parallel_sums(self):
+        ''' Returns the sample sums of each block, simulated on a pool of workers'''
+        jobs = [(start, stop, seed) for (start, stop), seed in zip(self._blocks(), self._seeds())]
+        workers = min(self.workers, len(jobs))
+        pool = ThreadPoolExecutor if self.backend == 'thread' else ProcessPoolExecutor
+
+        # Deal the blocks round-robin, then put the results back in block order
+        sums = [None] * len(jobs)
+        done = 0
+        with pool(max_workers=workers) as executor:
+            futures = {executor.submit(_run_blocks, self, jobs[w::workers]): w for w in range(workers)}
+            for future in as_completed(futures):
+                w = futures[future]
+                sums[w::workers] = future.result()
+                done += sum(stop - start for start, stop, seed in jobs[w::workers])
+                self._report(done)
+        return sums
+
+    def _increment_chunks(self, n, rng, first=0, shift=None):
+        '''
+            Yields the standard normal draws of the next (at most TIME_BLOCK) time steps for a block of n paths: (steps, n) arrays
+            Quasi draws take the Sobol points of paths first to first+n, with the digital shift of their replication.
+        '''
+        steps, dt = self._grid()
+        half = n // 2 if self.antithetic else n
+
+        if self.quasi:
+            point = first // 2 if self.antithetic else first
+            normals = _brownian_bridge(_sobol_normals(point, point + half, steps, shift, rng)).astype(self.dtype)
+            chunks = (normals[i:i+self.TIME_BLOCK] for i in range(0, steps, self.TIME_BLOCK))
+        else:
+            chunks = (rng.standard_normal((min(self.TIME_BLOCK, steps - i), half), dtype=self.dtype) for i in range(0, steps, self.TIME_BLOCK))
+
+        for Z in chunks:
+            yield np.concatenate([Z, -Z], axis=1) if self.antithetic else Z
+
+    def _advance(self, level, Z):
+        ''' Returns the next chunk of path levels (prices for euler, log prices for exact) from the last level and the draws'''
+        r = self.mu
+        steps, dt = self._grid()
+
+        if self.scheme == 'exact':
+            increments = (r - self.sigma**2 / 2) * dt + self.sigma * math.sqrt(dt) * Z
+            increments[0] += level
+            return np.cumsum(increments, axis=0, dtype=self.dtype)
+
+        factors = 1 + r*dt + self.sigma*math.sqrt(dt) * Z
+        factors[0] *= level
+        return np.cumprod(factors, axis=0, dtype=self.dtype)
+
+    def _paths(self, n, rng, first=0, shift=None):
+        ''' Yields the simulated prices of a block of n paths, TIME_BLOCK steps at a time'''
+        level = np.full(n, np.log(self.s0) if self.scheme == 'exact' else self.s0, dtype=self.dtype)
+
+        for Z in self._increment_chunks(n, rng, first, shift):
+            chunk = self._advance(level, Z)
+            level = chunk[-1]
+            yield np.exp(chunk) if self.scheme == 'exact' else chunk
+
+    def _new_stats(self, S0):
+        ''' Returns the running path statistics started from the initial prices'''
+        stats = {}
+        if self.category == 'asian':
+            stats['total'] = S0.astype(np.float64)
+            if self.control_variate:
+                stats['log_total'] = np.log(stats['total'])
+        elif self.category == 'lookback':
+            stats['max'], stats['min'] = S0.copy(), S0.copy()
+
+        if self.greeks == 'pathwise':
+            # Index of the last folded step, and the first step's prices for the likelihood ratio
+            stats['step'], stats['first'] = 0, None
+            # S0 does not depend on sigma
+            if self.category == 'asian':
+                stats['sens_total'] = np.zeros(len(S0))
+            elif self.category == 'lookback':
+                stats['max_sens'], stats['min_sens'] = np.zeros(len(S0)), np.zeros(len(S0))
+        return stats
+
+    def _update_stats(self, stats, chunk):
+        ''' Folds a (steps, n) chunk of prices into the running path statistics'''
+        if self.greeks == 'pathwise':
+            self._update_sens(stats, chunk)
+
+        if self.category == 'asian':
+            stats['total'] += chunk.sum(axis=0, dtype=np.float64)
+            if self.control_variate:
+                stats['log_total'] += np.log(chunk).sum(axis=0, dtype=np.float64)
+        elif self.category == 'lookback':
+            np.maximum(stats['max'], chunk.max(axis=0), out=stats['max'])
+            np.minimum(stats['min'], chunk.min(axis=0), out=stats['min'])
+
+    def _update_sens(self, stats, chunk):
+        ''' Folds a chunk of prices into the running sigma derivatives of the payoff statistics'''
+        steps, dt = self._grid()
+        step = stats['step']
+        if step == 0 and self.category == 'eu':
+            stats['first'] = chunk[0].astype(np.float64)
+        # dS_t/dsigma = S_t * (log(S_t/s0) - drift_t) / sigma
+        drift = (self.mu + self.sigma**2 / 2) * dt * np.arange(step + 1, step + 1 + len(chunk))
+
+        if self.category == 'asian':
+            sens = np.log(chunk / self.s0, dtype=np.float64)
+            sens -= drift[:, None]
+            sens *= chunk
+            stats['sens_total'] += sens.sum(axis=0) / self.sigma
+        elif self.category == 'lookback':
+            # The derivative of the extremum is the one of the path at the time of the extremum
+            paths = np.arange(chunk.shape[1])
+            for key, at, better in (('max', chunk.argmax(axis=0), np.greater), ('min', chunk.argmin(axis=0), np.less)):
+                value = chunk[at, paths].astype(np.float64)
+                sens = value * (np.log(value / self.s0) - drift[at]) / self.sigma
+                stats[f'{key}_sens'] = np.where(better(value, stats[key]), sens, stats[f'{key}_sens'])
+
+        stats['step'] = step + len(chunk)
+
+    def _final_stats(self, stats, last):
+        ''' Returns the path statistics the payoffs need: {last, mean, logmean, max, min}, and the greeks: {sens, max_sens, min_sens, weight}'''
+        steps, dt = self._grid()
+        points = steps + 1
+        final = {'last': last.astype(np.float64)}
+        if self.category == 'asian':
+            final['mean'] = stats['total'] / points
+            if self.control_variate:
+                final['logmean'] = stats['log_total'] / points
+        elif self.category == 'lookback':
+            final['max'], final['min'] = stats['max'].astype(np.float64), stats['min'].astype(np.float64)
+
+        if self.greeks == 'pathwise':
             if self.category == 'eu':
-                [self.callPrice, self.putPrice] = self._eu_option_price
+                final['sens'] = final['last'] * (np.log(final['last'] / self.s0) - (self.mu + self.sigma**2 / 2) * dt * steps) / self.sigma
             elif self.category == 'asian':
-                [self.callPrice, self.putPrice] = self._asian_option_price
-            elif self.category == 'lookback':
-                [self.callPrice, self.putPrice] = self._lookback_option_price
-
-    @property
-    def _eu_option_price(self):
-        call = np.exp(-self.mu*self.horizon) * np.mean(np.maximum(0, self.S[-1]-self.K))
-        put = np.exp(-self.mu*self.horizon) * np.mean(np.maximum(0, self.K-self.S[-1]))
-        return [call, put]
-
-    @property
-    def _asian_option_price(self):
-        A = self.S.mean(axis=0)
-
-        call = np.exp(-self.mu*self.horizon) * np.mean(np.maximum(0, A-self.K))
-        put = np.exp(-self.mu*self.horizon) * np.mean(np.maximum(0, self.K-A))
-        return [call, put]
-    
-    @property
-    def _lookback_option_price(self):
-        _max = self.S.max(axis=0)
-        _min = self.S.min(axis=0)
-
-        call = np.exp(-self.mu*self.horizon) * np.mean(np.maximum(0, _max-self.K))
-        put = np.exp(-self.mu*self.horizon) * np.mean(np.maximum(0, self.K-_min))
-        return [call, put]
+                final['sens'] = stats['sens_total'] / points
+            else:
+                final['max_sens'], final['min_sens'] = stats['max_sens'], stats['min_sens']
+            if self.category == 'eu':
+                # Score of s0 for the first log-normal increment: Z1 / (s0 * sigma * sqrt(dt))
+                z1 = (np.log(stats['first'] / self.s0) - (self.mu - self.sigma**2 / 2) * dt) / (self.sigma * math.sqrt(dt))
+                final['weight'] = z1 / (self.s0 * self.sigma * math.sqrt(dt))
+        return final
+
+    def _block_sums(self, start, stop, seed):
+        ''' Simulates one block of paths without storing them and returns its sample sums'''
+        rng = np.random.default_rng(seed)
+        n = stop - start
+        if self.antithetic:
+            n -= n % 2
+        if not self.quasi:
+            return self._path_sums(n, rng)
+
+        # A quasi block is a whole replication: one digital shift, simulated BLOCK_SIZE paths at a time
+        shift = _sobol_shift(self._grid()[0], rng)
+        sums = 0
+        for first in range(0, n, self.BLOCK_SIZE):
+            sums = sums + self._path_sums(min(self.BLOCK_SIZE, n - first), rng, first, shift)
+        return sums
+
+    def _path_sums(self, n, rng, first=0, shift=None):
+        ''' Simulates n paths without storing them and returns their sample sums'''
+        with self._timer.phase('paths'):
+            S = np.full(n, self.s0, dtype=self.dtype)
+            stats = self._new_stats(S)
+            for chunk in self._paths(n, rng, first, shift):
+                self._update_stats(stats, chunk)
+                S = chunk[-1]
+
+        with self._timer.phase('payoff'):
+            samples = self._samples(self._final_stats(stats, S))
+            if self.antithetic:
+                # Each antithetic pair is one sample
+                half = n // 2
+                samples = [None if x is None else (x[:half] + x[half:]) / 2 for x in samples]
+
+            return self._sums(*samples)
 
     def _simulate_path(self):
-        np.random.seed(2024)
-        
-        s0 = self.s0
-        r = self.mu
-        T = self.horizon
-        t = self.timesteps
         n = self.n_sims
-        
-        dt = T/t
-        
-        S = np.zeros((t,n))
-        S[0] = s0
-        
-        for i in range(t-1):
-            W = np.random.standard_normal(n)
-            S[i+1] = S[i] * (1 + r*dt + self.sigma*np.sqrt(dt) * W)
-            
+        steps, dt = self._grid()
+
+        S = np.empty((steps+1, n), dtype=self.dtype)
+        S[0] = self.s0
+
+        for (start, stop), seed in zip(self._blocks(), self._seeds()):
+            rng = np.random.default_rng(seed)
+            i = 1
+            with self._timer.phase('paths'):
+                for chunk in self._paths(stop - start, rng):
+                    S[i:i+len(chunk), start:stop] = chunk
+                    i += len(chunk)
+            self._report(stop)
+
         return S
-    
+
+    def __getstate__(self):
+        # The progress callback stays in the parent process when the option is sent to process workers
+        state = self.__dict__.copy()
+        state['progress'] = None
+        return state
+
     def __str__(self) -> str:
         return f'Option[Spot={self.s0}, Strike={self.K}, Rate={self.mu}, Horizon={self.horizon}, Vol={self.sigma}, timesteps={self.timesteps}, simulations={self.n_sims}]'
+
+def _run_blocks(option, jobs):
+    ''' Worker entry point: returns the sample sums of the given (start, stop, seed) blocks'''
+    return [option._block_sums(start, stop, seed) for start, stop, seed in jobs]
+
+# Sobol direction numbers (Joe & Kuo) for dimensions 2 to 21: (degree, coefficients, initial m_i)
+SOBOL_TABLE = [
+    (1, 0, [1]), (2, 1, [1, 3]), (3, 1, [1, 3, 1]), (3, 2, [1, 1, 1]), (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]), (5, 2, [1, 1, 5, 5, 17]), (5, 4, [1, 1, 5, 5, 5]), (5, 7, [1, 1, 7, 11, 19]),
+    (5, 11, [1, 1, 5, 1, 1]), (5, 13, [1, 1, 1, 3, 11]), (5, 14, [1, 3, 5, 5, 31]), (6, 1, [1, 3, 3, 9, 7, 49]),
+    (6, 13, [1, 1, 1, 15, 21, 21]), (6, 16, [1, 3, 1, 13, 27, 49]), (6, 19, [1, 1, 1, 15, 7, 5]),
+    (6, 22, [1, 3, 1, 15, 13, 25]), (6, 25, [1, 1, 5, 5, 19, 61]), (7, 1, [1, 3, 7, 11, 23, 15, 103]),
+    (7, 4, [1, 3, 7, 13, 13, 15, 69]),
+]
+SOBOL_BITS = 32
+
+@lru_cache(maxsize=None)
+def _sobol_directions():
+    ''' Returns the direction numbers of every Sobol dimension as a (dims, bits) uint64 array'''
+    V = np.zeros((len(SOBOL_TABLE) + 1, SOBOL_BITS), dtype=np.uint64)
+    V[0] = [1 << (SOBOL_BITS - j) for j in range(1, SOBOL_BITS + 1)]
+
+    for d, (s, a, m) in enumerate(SOBOL_TABLE, start=1):
+        v = [0] * (SOBOL_BITS + 1)
+        for j in range(1, s + 1):
+            v[j] = m[j-1] << (SOBOL_BITS - j)
+        for j in range(s + 1, SOBOL_BITS + 1):
+            v[j] = v[j-s] ^ (v[j-s] >> s)
+            for k in range(1, s):
+                if (a >> (s - 1 - k)) & 1:
+                    v[j] ^= v[j-k]
+        V[d] = v[1:]
+
+    return V
+
+def _sobol_shift(steps, rng):
+    ''' Returns a random digital shift of the Sobol dimensions of steps time steps: (dims, 1) uint64 array'''
+    dims = min(steps, len(_sobol_directions()))
+    return rng.integers(0, 2**SOBOL_BITS, size=(dims, 1), dtype=np.uint64)
+
+def _sobol_normals(start, stop, steps, shift, rng):
+    ''' Returns (steps, stop - start) normals: the Sobol points start to stop with a digital shift, padded with pseudo-random draws past the table'''
+    V = _sobol_directions()
+    dims = len(shift)
+    n = stop - start
+
+    # Gray code ordering: point i is the XOR of the directions of the set bits of i ^ (i >> 1)
+    i = np.arange(start, stop, dtype=np.uint64)
+    gray = i ^ (i >> np.uint64(1))
+    x = np.zeros((dims, n), dtype=np.uint64)
+    for bit in range(SOBOL_BITS):
+        on = ((gray >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+        x[:, on] ^= V[:dims, bit][:, None]
+
+    u = ((x ^ shift).astype(float) + 0.5) / 2**SOBOL_BITS
+
+    Z = np.empty((steps, n))
+    Z[:dims] = norm_ppf(u)
+    Z[dims:] = rng.standard_normal((steps - dims, n))
+    return Z
+
+@lru_cache(maxsize=64)
+def _bridge_schedule(steps):
+    ''' Returns the Brownian bridge construction order: [(point, left, right, left weight, right weight, std dev)]'''
+    order = [(steps, 0, 0, 0.0, 0.0, math.sqrt(steps))]
+    queue = deque([(0, steps)])
+    while queue:
+        left, right = queue.popleft()
+        if right - left < 2:
+            continue
+        mid = (left + right) // 2
+        order.append((mid, left, right, (right-mid)/(right-left), (mid-left)/(right-left), math.sqrt((mid-left)*(right-mid)/(right-left))))
+        queue.append((left, mid))
+        queue.append((mid, right))
+    return order
+
+def _brownian_bridge(Z):
+    ''' Maps (steps, n) normals, coarsest first, to (steps, n) standard normal increments of a Brownian path'''
+    steps = Z.shape[0]
+    if steps == 0:
+        return Z
+
+    W = np.zeros((steps + 1, Z.shape[1]))
+    for k, (point, left, right, wl, wr, sd) in enumerate(_bridge_schedule(steps)):
+        if k == 0:
+            W[point] = sd * Z[k]
+        else:
+            W[point] = wl * W[left] + wr * W[right] + sd * Z[k]
+
+    return np.diff(W, axis=0)
@@ -0,0 +1,173 @@
+import numpy as np
+from options.bs import bs_price
+from metrics import registry
+
+class ScenarioLadder(object):
+    """
+        This class revalues a book of Vanilla European option positions over a grid of
+        scenarios with the Black-Scholes model (options.bs): every spot shock x vol shock x
+        time decay, and aggregates the PnL by group (underlying and expiry by default).
+
+        The book is revalued chunk by chunk, each chunk being one broadcast NumPy computation
+        over (positions, spot shocks, vol shocks, horizons). A chunk holds about MAX_CELLS
+        position-scenario cells, which bounds the memory whatever the size of the book and keeps
+        the arrays in the CPU cache. The PnL of a chunk is summed into its groups right away and
+        the per-position values are dropped.
+
+        Positions, as a list of objects or a dict of columns (rate, vol and div in %, as for BlackScholesOption):
+        contract_type : str ['C' or 'P']
+        spot, strike, rate, dte, vol : float
+        quantity : float [default 1, negative for short positions]
+        div : float [default 0]
+        underlying, expiry : any [grouping labels, default '' and the dte]
+
+        Attributes:
+        spot_shocks : ndarray [relative spot moves in %]
+        vol_shocks : ndarray [volatility moves in vol points]
+        horizons : ndarray [time decay in calendar days]
+        by : tuple [grouping fields]
+        groups : list [group labels, one tuple of the `by` fields per group]
+        value : ndarray [value of each group today]
+        pnl : ndarray [PnL of each group in every scenario, shape (groups, spot shocks, vol shocks, horizons)]
+        total : ndarray [PnL of the whole book in every scenario, shape (spot shocks, vol shocks, horizons)]
+    """
+    MAX_CELLS = 2**16
+
+    def __init__(self, positions, spot_shocks=(0,), vol_shocks=(0,), horizons=(0,), by=('underlying', 'expiry'), chunk_size=None):
+        self.spot_shocks = np.atleast_1d(np.asarray(spot_shocks, dtype=float))
+        self.vol_shocks = np.atleast_1d(np.asarray(vol_shocks, dtype=float))
+        self.horizons = np.atleast_1d(np.asarray(horizons, dtype=float))
+        self.by = tuple(by)
+
+        if np.any(self.spot_shocks <= -100):
+            raise ValueError('spot shocks must be above -100%')
+        if np.any(self.horizons < 0):
+            raise ValueError('horizons must be positive')
+
+        columns = self._columns(positions)
+        book = self._inputs(columns)
+        n = book['spot'].size
+        cells = self.spot_shocks.size * self.vol_shocks.size * self.horizons.size
+        self.chunk_size = chunk_size or max(1, self.MAX_CELLS // cells)
+
+        # Positions sorted by group, so that every chunk sums contiguous runs of rows
+        labels = [self._labels(columns, field, n) for field in self.by]
+        index = {}
+        codes = np.array([index.setdefault(key, len(index)) for key in zip(*labels)], dtype=int)
+        self.groups = list(index)
+        order = np.argsort(codes, kind='stable')
+        self._codes = codes[order]
+        self._book = {key: value[order] for key, value in book.items()}
+
+        with registry.timer('engine_seconds', engine='scenarios'):
+            self.value, self.pnl = self._revalue()
+        self.total = self.pnl.sum(axis=0)
+
+    def _columns(self, positions):
+        ''' Returns the positions as a dict of columns'''
+        if isinstance(positions, list):
+            if not all(isinstance(position, dict) for position in positions):
+                raise TypeError('positions must be objects')
+            keys = {key for position in positions for key in position}
+            return {key: [position.get(key) for position in positions] for key in keys}
+        return {key: positions[key] for key in positions.keys()}
+
+    def _labels(self, columns, field, n):
+        ''' Returns the grouping labels of one field'''
+        if field == 'expiry' and 'expiry' not in columns:
+            field = 'dte'
+        if field not in columns:
+            if field != 'underlying':
+                raise ValueError(f'missing field {field!r}')
+            return [''] * n
+        labels = columns[field]
+        return labels.tolist() if hasattr(labels, 'tolist') else list(labels)
+
+    def _inputs(self, columns):
+        ''' Returns the validated book inputs as float arrays, rate, vol and div as fractions'''
+        def column(key, default=None):
+            if key not in columns:
+                if default is None:
+                    raise ValueError(f'missing field {key!r}')
+                return np.full(n, float(default))
+            try:
+                values = np.asarray(columns[key], dtype=float)
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} must be numeric')
+            if values.shape != (n,):
+                raise ValueError(f'{key} must have one value per position')
+            return values
+
+        if 'contract_type' not in columns:
+            raise ValueError("missing field 'contract_type'")
+        contract_type = np.asarray(columns['contract_type'], dtype=object)
+        n = contract_type.size
+        if not np.all((contract_type == 'C') | (contract_type == 'P')):
+            raise ValueError("contract_type must be 'C' or 'P'")
+
+        book = {
+            'phi': np.where(contract_type == 'C', 1.0, -1.0),
+            'quantity': column('quantity', 1),
+            'spot': column('spot'),
+            'strike': column('strike'),
+            'rate': np.round(column('rate') / 100, 4),
+            'dte': np.round(column('dte'), 4),
+            'vol': np.round(column('vol') / 100, 4),
+            'div': np.round(column('div', 0) / 100, 4),
+        }
+        if np.any(book['spot'] <= 0) or np.any(book['strike'] <= 0):
+            raise ValueError('spot and strike must be positive')
+        if np.any(book['vol'] < 0) or np.any(book['dte'] < 0):
+            raise ValueError('vol and dte cannot be negative')
+        if not all(np.all(np.isfinite(value)) for value in book.values()):
+            raise ValueError('positions must have finite inputs')
+        return book
+
+    def _revalue(self):
+        ''' Returns the value of every group today and its PnL in every scenario'''
+        book, codes = self._book, self._codes
+        groups = len(self.groups)
+        shape = (self.spot_shocks.size, self.vol_shocks.size, self.horizons.size)
+
+        base = book['quantity'] * bs_price(book['spot'], book['strike'], book['rate'], book['dte'], book['vol'], book['div'], book['phi'])
+        value = np.bincount(codes, weights=base, minlength=groups)
+
+        # Scenario axes, broadcast against the positions of a chunk
+        spot_moves = 1 + self.spot_shocks[None, :, None, None] / 100
+        vol_moves = self.vol_shocks[None, None, :, None] / 100
+        decay = self.horizons[None, None, None, :] / 365
+
+        pnl = np.zeros((groups,) + shape)
+        for start in range(0, codes.size, self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            col = lambda key: book[key][chunk, None, None, None]
+
+            values = bs_price(col('spot') * spot_moves, col('strike'), col('rate'), np.maximum(col('dte') - decay, 0.0),
+                              np.maximum(col('vol') + vol_moves, 0.0), col('div'), col('phi'))
+            values *= col('quantity')
+
+            # Sum the runs of positions of the same group
+            run = codes[chunk]
+            starts = np.flatnonzero(np.r_[True, run[1:] != run[:-1]])
+            pnl[run[starts]] += np.add.reduceat(values, starts, axis=0)
+
+        pnl -= value[:, None, None, None]
+        return value, pnl
+
+    def to_dict(self):
+        ''' Returns the ladder as flat columns: {name: list}, one row per group and scenario'''
+        groups, spot, vol, horizon = np.indices(self.pnl.shape).reshape(4, -1)
+        columns = {field: [self.groups[g][i] for g in groups] for i, field in enumerate(self.by)}
+        columns.update({
+            'spot_shock': self.spot_shocks[spot].tolist(),
+            'vol_shock': self.vol_shocks[vol].tolist(),
+            'horizon': self.horizons[horizon].tolist(),
+            'pnl': self.pnl.ravel().tolist(),
+        })
+        return columns
+
+    def __len__(self):
+        return self._codes.size
+
+    def __str__(self) -> str:
+        return f'ScenarioLadder[Positions={self._codes.size}, Groups={len(self.groups)}, Scenarios={self.total.size}]'
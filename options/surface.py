@@ -0,0 +1,261 @@
+import hashlib
+import numpy as np
+from options.bs import BlackScholesIV
+from cache import ResultCache, make_key
+
+METHODS = ['svi', 'pchip']
+
+# Fitted surfaces, keyed by their quotes, so that a chain is only fitted once
+surface_cache = ResultCache(max_entries=64, ttl=3600.0)
+
+class VolSurface(object):
+    """
+        Implied volatility surface fitted on a chain of quotes.
+
+        Every expiry slice is fitted in total implied variance w = vol**2 * T against the
+        log-moneyness k = log(strike / forward):
+        - 'svi': the raw SVI parametrization w(k) = a + b * (rho * (k - m) + sqrt((k - m)**2 + sigma**2)),
+          fitted quasi-explicitly: for a given (m, sigma) the fit is linear in the other three
+          parameters, so a grid of (m, sigma) candidates is solved at once and zoomed into
+          around the best one. Candidates breaking b >= 0, |rho| <= 1, w >= 0 or Lee's wing
+          bound b * (1 + |rho|) <= 4 are discarded.
+        - 'pchip': a shape-preserving piecewise cubic through the quotes (Fritsch-Carlson), so the
+          slice never overshoots the quoted variances, with linear wings of slope at most 2 (Lee).
+        Slices with fewer than 5 quotes fall back to pchip.
+
+        Between expiries the total variance is interpolated linearly in time at constant
+        log-moneyness, and kept non-decreasing so that the surface has no calendar arbitrage.
+        Before the first expiry and after the last one the slice volatility is held constant.
+
+        The slices are fitted once, at construction. vol(strike, expiry) is vectorized: each
+        query finds its expiry bracket (and, for pchip, its knot interval) by binary search,
+        so pricing off the surface costs a lookup. The surface is callable as vol(strike, expiry),
+        which is how BlackScholesOption, BlackScholesChain, EuFdm, MonteCarloOption and
+        LatticeOption accept it in place of a flat volatility.
+
+        Units are the same as for BlackScholesOption (rate, vol and div in %).
+
+        Attributes:
+        spot : float [underlying asset current price]
+        rate : float [interest rate]
+        div : float [underlying asset dividend yield]
+        method : str ['svi' or 'pchip']
+        expiries : ndarray [expiry of every slice in years]
+        slices : list [fitted slices, called as slice(k) for the total variance]
+    """
+    MIN_SVI_QUOTES = 5
+
+    def __init__(self, spot, strikes, expiries, vols, rate, div=0, method='svi'):
+        if method not in METHODS:
+            raise ValueError(f'Unknown method {method!r}, expected one of {METHODS}')
+
+        strikes, expiries, vols = np.broadcast_arrays(*[np.asarray(x, dtype=float).ravel() for x in (strikes, expiries, vols)])
+        keep = np.isfinite(vols) & (vols > 0) & (expiries > 0) & (strikes > 0)
+        if not keep.any():
+            raise ValueError('The surface needs at least one valid quote')
+        strikes, expiries, vols = strikes[keep], expiries[keep], vols[keep]
+
+        self.spot = spot
+        self.rate = round(rate / 100, 4)
+        self.div = round(div / 100, 4)
+        self.method = method
+        self.expiries = np.unique(expiries)
+        self.slices = []
+
+        for T in self.expiries:
+            at = expiries == T
+            k = np.log(strikes[at] / self._forward(T))
+            w = (vols[at] / 100) ** 2 * T
+            if method == 'svi' and np.unique(k).size >= self.MIN_SVI_QUOTES:
+                self.slices.append(SviSlice(k, w))
+            else:
+                self.slices.append(PchipSlice(k, w))
+
+    @classmethod
+    def from_prices(cls, prices, spot, strikes, expiries, rate, div=0, contract_type='C', method='svi', cache=True):
+        '''
+            Returns the surface fitted on the implied volatilities of a chain of option prices.
+            Quotes whose volatility cannot be implied (arbitrage, no convergence) are left out.
+            With cache=True the surface is kept in surface_cache and the same chain is not refitted.
+        '''
+        prices, strikes, expiries, is_call = np.broadcast_arrays(*[np.asarray(x) for x in (prices, strikes, expiries, contract_type)])
+
+        key = None
+        if cache:
+            digest = hashlib.sha1()
+            for x in (prices, strikes, expiries):
+                digest.update(np.ascontiguousarray(x, dtype=float).tobytes())
+            digest.update(np.ascontiguousarray(is_call).astype(str).tobytes())
+            key = make_key('surface', method, float(spot), float(rate), float(div), digest.hexdigest())
+            surface = surface_cache.get(key)
+            if surface is not None:
+                return surface
+
+        iv = BlackScholesIV(prices, spot, strikes, rate, expiries, div, is_call)
+        vols = np.where(iv.converged, iv.vol, np.nan)
+        surface = cls(spot, strikes, expiries, vols, rate, div, method)
+
+        if cache:
+            surface_cache.set(key, surface)
+        return surface
+
+    def _forward(self, T):
+        return self.spot * np.exp((self.rate - self.div) * T)
+
+    def total_variance(self, k, T):
+        ''' Returns the total implied variance at log-moneyness k and expiry T (vectorized)'''
+        k, T = np.broadcast_arrays(np.asarray(k, dtype=float), np.asarray(T, dtype=float))
+        k, T = k.ravel(), T.ravel()
+        n = len(self.expiries)
+
+        # Bracketing slices: i is the last expiry <= T
+        i = np.searchsorted(self.expiries, T, side='right') - 1
+        lo, hi = np.clip(i, 0, n - 1), np.clip(i + 1, 0, n - 1)
+        w_lo, w_hi = self._slice_values(lo, k), self._slice_values(hi, k)
+
+        T_lo, T_hi = self.expiries[lo], self.expiries[hi]
+        inside = (i >= 0) & (i < n - 1)
+        weight = np.where(inside, (T - T_lo) / np.where(inside, T_hi - T_lo, 1.0), 0.0)
+        w = w_lo + (np.maximum(w_hi, w_lo) - w_lo) * weight
+        # Constant volatility before the first and after the last expiry
+        w = np.where(i < 0, w_hi * T / T_hi, w)
+        w = np.where(i >= n - 1, w_lo * T / T_lo, w)
+        return w
+
+    def _slice_values(self, index, k):
+        ''' Returns the total variance of slice index[j] at k[j], evaluating each slice once'''
+        w = np.empty_like(k)
+        for i in np.unique(index):
+            at = index == i
+            w[at] = self.slices[i](k[at])
+        return w
+
+    def vol(self, strike, expiry):
+        ''' Returns the implied volatility (in %) at the given strikes and expiries, broadcast against each other'''
+        strike, expiry = np.broadcast_arrays(np.asarray(strike, dtype=float), np.asarray(expiry, dtype=float))
+        if np.any(expiry <= 0):
+            raise ValueError('Expiries must be positive')
+
+        k = np.log(strike / self._forward(expiry))
+        w = self.total_variance(k, expiry).reshape(strike.shape)
+        vol = np.sqrt(np.maximum(w, 0.0) / expiry) * 100
+        return vol if vol.ndim else float(vol)
+
+    __call__ = vol
+
+    def __len__(self):
+        return len(self.slices)
+
+    def __str__(self) -> str:
+        return f'VolSurface[Spot={self.spot}, Rate={self.rate}, Div={self.div}, Method={self.method}, Expiries={len(self.expiries)}]'
+
+class SviSlice(object):
+    """
+        Raw SVI slice of total variance: w(k) = a + b * (rho * (k - m) + sqrt((k - m)**2 + sigma**2)).
+
+        Attributes:
+        a, b, rho, m, sigma : float [SVI parameters]
+        rmse : float [root mean square error of the fit in total variance]
+    """
+    GRID = 21
+    ZOOMS = 4
+
+    def __init__(self, k, w):
+        k, w = np.asarray(k, dtype=float), np.asarray(w, dtype=float)
+        width = max(k.max() - k.min(), 1e-4)
+        m_lo, m_hi = k.min() - width / 2, k.max() + width / 2
+        s_lo, s_hi = np.log(1e-3), np.log(max(2 * width, 1e-2))
+
+        best = None
+        for _ in range(self.ZOOMS):
+            m, log_s = np.meshgrid(np.linspace(m_lo, m_hi, self.GRID), np.linspace(s_lo, s_hi, self.GRID))
+            params, error = self._solve(k, w, m.ravel(), np.exp(log_s.ravel()))
+            j = int(np.argmin(error))
+            if not np.isfinite(error[j]):
+                break
+            best = (params[j], m.ravel()[j], np.exp(log_s.ravel()[j]), error[j])
+
+            # Zoom into the neighbourhood of the best candidate
+            dm, ds = (m_hi - m_lo) / (self.GRID - 1), (s_hi - s_lo) / (self.GRID - 1)
+            m_lo, m_hi = m.ravel()[j] - 2 * dm, m.ravel()[j] + 2 * dm
+            s_lo, s_hi = log_s.ravel()[j] - 2 * ds, log_s.ravel()[j] + 2 * ds
+
+        if best is None:
+            raise ValueError('No arbitrage-free SVI fit for this slice')
+
+        (a, d, c), self.m, self.sigma, error = best
+        self.a = float(a)
+        self.b = float(c / self.sigma)
+        self.rho = float(d / c) if c > 0 else 0.0
+        self.m, self.sigma = float(self.m), float(self.sigma)
+        self.rmse = float(np.sqrt(error / len(k)))
+
+    @staticmethod
+    def _solve(k, w, m, sigma):
+        '''
+            Least squares of w = a + d * y + c * sqrt(y**2 + 1), y = (k - m) / sigma, for every candidate (m, sigma)
+            Returns the (candidates, 3) parameters [a, d, c] and the squared errors, inf where a constraint breaks
+        '''
+        y = (k[None, :] - m[:, None]) / sigma[:, None]
+        X = np.stack([np.ones_like(y), y, np.sqrt(y**2 + 1)], axis=2)
+        A = np.einsum('cni,cnj->cij', X, X) + 1e-12 * np.eye(3)
+        params = np.linalg.solve(A, np.einsum('cni,n->ci', X, w)[..., None])[..., 0]
+        a, d, c = params.T
+
+        error = ((np.einsum('cni,ci->cn', X, params) - w) ** 2).sum(axis=1)
+        b = c / sigma
+        valid = (c >= 0) & (np.abs(d) <= c) & (a + np.sqrt(np.maximum(c**2 - d**2, 0)) >= 0) & (b + np.abs(d) / sigma <= 4)
+        return params, np.where(valid, error, np.inf)
+
+    def __call__(self, k):
+        x = np.asarray(k, dtype=float) - self.m
+        return self.a + self.b * (self.rho * x + np.sqrt(x**2 + self.sigma**2))
+
+class PchipSlice(object):
+    """
+        Shape-preserving piecewise cubic (Fritsch-Carlson) slice of total variance, with linear wings.
+        Quotes sharing a log-moneyness are averaged; a single quote gives a flat slice.
+
+        Attributes:
+        k : ndarray [knots in log-moneyness]
+        w : ndarray [total variance at the knots]
+        slopes : ndarray [derivative at the knots]
+    """
+    def __init__(self, k, w):
+        self.k, inverse = np.unique(np.asarray(k, dtype=float), return_inverse=True)
+        self.w = np.bincount(inverse, weights=w) / np.bincount(inverse)
+
+        if len(self.k) == 1:
+            self.slopes = np.zeros(1)
+            return
+
+        h = np.diff(self.k)
+        delta = np.diff(self.w) / h
+        slopes = np.empty(len(self.k))
+        slopes[0], slopes[-1] = delta[0], delta[-1]
+
+        # Weighted harmonic mean of the neighbouring secants, zero at local extrema
+        w1, w2 = 2 * h[1:] + h[:-1], h[1:] + 2 * h[:-1]
+        same = delta[:-1] * delta[1:] > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes[1:-1] = np.where(same, (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:]), 0.0)
+
+        # Wings no steeper than Lee's moment bound
+        slopes[0], slopes[-1] = np.clip(slopes[0], -2, 2), np.clip(slopes[-1], -2, 2)
+        self.slopes = slopes
+
+    def __call__(self, k):
+        k = np.asarray(k, dtype=float)
+        if len(self.k) == 1:
+            return np.full(k.shape, self.w[0])
+
+        i = np.clip(np.searchsorted(self.k, k) - 1, 0, len(self.k) - 2)
+        h = self.k[i + 1] - self.k[i]
+        t = (k - self.k[i]) / h
+        # Cubic Hermite basis
+        w = ((2 * t**3 - 3 * t**2 + 1) * self.w[i] + (t**3 - 2 * t**2 + t) * h * self.slopes[i]
+             + (-2 * t**3 + 3 * t**2) * self.w[i + 1] + (t**3 - t**2) * h * self.slopes[i + 1])
+
+        w = np.where(k < self.k[0], self.w[0] + self.slopes[0] * (k - self.k[0]), w)
+        w = np.where(k > self.k[-1], self.w[-1] + self.slopes[-1] * (k - self.k[-1]), w)
+        return np.maximum(w, 0.0)
@@ -0,0 +1,39 @@
+import pytest
+from options.batch import BatchPricer
+
+CONTRACT = {'contract_type': 'P', 'spot': 100, 'strike': 100, 'rate': 5, 'vol': 20, 'dte': 1}
+
+def test_monte_carlo_needs_two_timesteps():
+    pricer = BatchPricer([dict(CONTRACT, model='monte-carlo', timesteps=1)])
+    assert pricer.errors == [(0, 'timesteps must be between 2 and 1000')]
+
+@pytest.mark.parametrize('american, expected', [(True, True), (False, False), ('true', True), ('False', False)])
+def test_lattice_american_flag(american, expected):
+    pricer = BatchPricer([dict(CONTRACT, model='lattice', american=american)])
+    assert pricer.rows[0]['american'] is expected
+
+def test_lattice_american_flag_rejects_other_values():
+    pricer = BatchPricer([dict(CONTRACT, model='lattice', american='no')])
+    assert pricer.errors == [(0, 'american must be true or false')]
+
+@pytest.mark.parametrize('key', ['spot', 'strike', 'rate', 'vol', 'dte', 'div'])
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), float('-inf')])
+def test_non_finite_inputs_are_rejected(key, value):
+    for model in ['bs', 'fdm', 'monte-carlo', 'lattice']:
+        if key == 'div' and model in ('fdm', 'monte-carlo'):
+            continue
+        pricer = BatchPricer([dict(CONTRACT, model=model, **{key: value})])
+        assert pricer.errors == [(0, f'{key} must be a finite number')], model
+
+def test_monte_carlo_rejects_horizons_rounded_to_zero():
+    pricer = BatchPricer([dict(CONTRACT, model='monte-carlo', dte=0.004), dict(CONTRACT, model='monte-carlo', dte=0.005)])
+    assert pricer.errors == [(0, 'monte-carlo dte must be at least 0.005 years')]
+
+@pytest.mark.parametrize('category', ['asian', 'lookback'])
+def test_monte_carlo_greeks_methods(category):
+    contract = dict(CONTRACT, model='monte-carlo', category=category, timesteps=6, n_sims=2**15)
+    pricer = BatchPricer([contract, dict(contract, greeks='bump'), dict(contract, greeks=None)])
+    pathwise, bump, none = zip(pricer.price()['price'], pricer.price()['gamma'])
+    assert pathwise[0] == bump[0] == none[0]
+    assert pathwise[1] == pytest.approx(bump[1], rel=1e-6)
+    assert none[1] is None
@@ -0,0 +1,24 @@
+import pandas as pd
+import batch_price
+from options import batch
+
+def test_pricing_errors_are_reported_per_row(tmp_path, monkeypatch):
+    engine = batch.LatticeOption
+
+    def lattice(spot, strike, *args, **kwargs):
+        if strike == 90:
+            raise ValueError('the tree failed')
+        return engine(spot, strike, *args, **kwargs)
+    monkeypatch.setattr(batch, 'LatticeOption', lattice)
+
+    source, target = tmp_path / 'positions.csv', tmp_path / 'priced.csv'
+    pd.DataFrame({
+        'model': ['lattice', 'lattice', 'bs', 'bs'],
+        'contract_type': ['C', 'P', 'C', 'X'],
+        'spot': 100, 'strike': [90, 100, 100, 100], 'rate': 5, 'vol': 20, 'dte': 1, 'steps': 100,
+    }).to_csv(source, index=False)
+
+    assert batch_price.run(str(source), str(target), chunk_size=3) == (4, 2)
+    priced = pd.read_csv(target, keep_default_na=False)
+    assert list(priced['error']) == ['the tree failed', '', '', "contract_type must be 'C' or 'P'"]
+    assert priced['price'][1] != '' and priced['price'][2] != ''
@@ -0,0 +1,39 @@
+import time
+import pytest
+from jobs import JobManager
+
+PARAMS = {'s0': 100, 'K': 100, 'mu': 5, 'sigma': 20, 'horizon': 1, 'timesteps': 252, 'category': 'asian', 'streaming': True}
+
+@pytest.fixture
+def manager():
+    manager = JobManager(max_workers=1)
+    yield manager
+    manager.shutdown()
+
+def wait(manager, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while manager.status(job_id)['state'] in ('queued', 'running'):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    return manager.status(job_id)
+
+def test_cancelling_a_finished_job_keeps_its_result(manager):
+    job_id = manager.submit('monte-carlo', dict(PARAMS, n_sims=1000))
+    assert wait(manager, job_id)['state'] == 'done'
+
+    assert manager.cancel(job_id)
+    status = manager.status(job_id)
+    assert status['state'] == 'done'
+    assert status['result']['callPrice'] > 0
+
+def test_cancelling_a_running_job(manager):
+    job_id = manager.submit('monte-carlo', dict(PARAMS, n_sims=10**7))
+    deadline = time.monotonic() + 60
+    while manager.status(job_id)['progress']['done'] == 0:
+        assert manager.status(job_id)['state'] in ('queued', 'running') and time.monotonic() < deadline
+        time.sleep(0.05)
+
+    assert manager.cancel(job_id)
+    status = wait(manager, job_id)
+    assert status['state'] == 'cancelled'
+    assert 'result' not in status
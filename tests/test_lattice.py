@@ -0,0 +1,23 @@
+import pytest
+from options.batch import BatchPricer
+from options.bs import BlackScholesOption
+from options.lattice import LatticeOption, check_tree
+
+def test_bbsr_needs_even_steps():
+    with pytest.raises(ValueError, match='even'):
+        LatticeOption(100, 100, 5, 1, 20, steps=201, method='bbsr')
+
+def test_bbsr_matches_black_scholes_for_european_options():
+    option = LatticeOption(100, 100, 5, 1, 20, steps=200, american=False, method='bbsr')
+    bs = BlackScholesOption(100, 100, 5, 1, 20)
+    assert option.callPrice == pytest.approx(bs.callPrice, abs=1e-4)
+    assert option.putPrice == pytest.approx(bs.putPrice, abs=1e-4)
+
+def test_negative_probabilities_are_rejected_up_front():
+    with pytest.raises(ValueError, match='negative probabilities'):
+        check_tree(50, 1, 1, steps=8)
+
+    contract = {'model': 'lattice', 'contract_type': 'C', 'spot': 100, 'strike': 100, 'rate': 50, 'vol': 1, 'dte': 1, 'steps': 8}
+    pricer = BatchPricer([contract, dict(contract, rate=5, vol=20)])
+    assert [i for i, message in pricer.errors] == [0]
+    assert pricer.price()['price'][0] > 0
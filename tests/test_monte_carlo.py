@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from options.bs import BlackScholesOption
+from options.monte_carlo import MonteCarloOption
+
+@pytest.mark.parametrize('timesteps', [MonteCarloOption.TIME_BLOCK + 1, MonteCarloOption.TIME_BLOCK + 2, 252])
+@pytest.mark.parametrize('antithetic', [False, True])
+def test_quasi_paths_span_several_time_blocks(timesteps, antithetic):
+    option = MonteCarloOption(100, 100, 5, 20, 1.0, timesteps, 4096, 'asian', quasi=True, antithetic=antithetic)
+    assert np.isfinite([option.callPrice, option.putPrice, option.callStdErr, option.putStdErr]).all()
+    assert 5 < option.callPrice < 7
+
+def test_quasi_eu_matches_black_scholes():
+    option = MonteCarloOption(100, 100, 5, 20, 1.0, 252, 4096, 'eu', scheme='euler', quasi=True)
+    bs = BlackScholesOption(100, 100, 5, 1.0, 20)
+    assert abs(option.callPrice - bs.callPrice) < 4 * option.callStdErr + 0.05
+    assert abs(option.putPrice - bs.putPrice) < 4 * option.putStdErr + 0.05
+
+def test_quasi_replications_are_simulated_in_path_blocks():
+    class SmallBlocks(MonteCarloOption):
+        BLOCK_SIZE = 256
+
+    # Within the Sobol table every draw is quasi-random, so the path blocks do not change the replications
+    whole = MonteCarloOption(100, 100, 5, 20, 1.0, 12, 16 * 1000, 'lookback', quasi=True)
+    split = SmallBlocks(100, 100, 5, 20, 1.0, 12, 16 * 1000, 'lookback', quasi=True)
+    assert split.callPrice == pytest.approx(whole.callPrice, rel=1e-12)
+    assert split.putStdErr == pytest.approx(whole.putStdErr, rel=1e-9)
+
+@pytest.mark.parametrize('category, strike', [('eu', 100), ('asian', 100), ('asian', 110), ('lookback', 105), ('lookback', 90)])
+def test_pathwise_greeks_match_bump(category, strike):
+    args = (100, strike, 5, 20, 1.0, 12, 2**16, category)
+    pathwise = MonteCarloOption(*args, streaming=True, greeks='pathwise')
+    bump = MonteCarloOption(*args, streaming=True, greeks='bump')
+    for name in MonteCarloOption.GREEKS:
+        error = np.hypot(getattr(pathwise, f'{name}StdErr'), getattr(bump, f'{name}StdErr'))
+        assert abs(getattr(pathwise, name) - getattr(bump, name)) <= 4 * error + 1e-6, name
+
+@pytest.mark.parametrize('timesteps', [4, 6, 252])
+def test_asian_call_and_put_gammas_are_equal(timesteps):
+    # Put-call parity: the call less the put is linear in s0
+    option = MonteCarloOption(100, 100, 5, 20, 1.0, timesteps, 2**14, 'asian', streaming=True, greeks='pathwise')
+    assert option.callGamma == pytest.approx(option.putGamma, rel=1e-9)
+
+def test_lookback_put_always_in_the_money_has_no_gamma():
+    # min <= s0 < K on every path, so the put is linear in s0
+    option = MonteCarloOption(100, 110, 5, 20, 1.0, 6, 2**14, 'lookback', streaming=True, greeks='pathwise')
+    assert option.putGamma == pytest.approx(0, abs=1e-9)
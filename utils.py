@@ -1,25 +1,54 @@
-import pandas as pd
+import numpy as np
 import math
+from metrics import PhaseTimer
+
+def greek_profile(contract_type, spot, strike, rate, vol, dte, div, axis='spot', lower=None, upper=None, points=101, step=None):
+    """
+    Compute the Black-Scholes greeks over a grid of one input in a single vectorized pass.
+    axis selects the input that varies: 'spot' (default range -/+20%), 'vol' (in %, default 50%-150%)
+    or 'dte' (in years, default 10%-200%). The grid is np.arange(lower, upper, step) when step is given,
+    otherwise points evenly spaced values from lower to upper.
+    Returns a dict of lists keyed by the axis ('Strike' for spot, as the templates expect) and the greeks.
+    The time spent pricing the grid and converting it to lists is recorded under the 'graph' engine.
+    """
+    from options.bs import BlackScholesChain
+
+    defaults = {'spot': (spot * 0.8, spot * 1.2), 'vol': (vol * 0.5, vol * 1.5), 'dte': (dte * 0.1, dte * 2)}
+    keys = {'spot': 'Strike', 'vol': 'Vol', 'dte': 'DTE'}
+    if axis not in defaults:
+        raise ValueError(f'Unknown axis {axis!r}, expected one of {list(defaults)}')
+
+    lower = defaults[axis][0] if lower is None else lower
+    upper = defaults[axis][1] if upper is None else upper
+    x = np.arange(lower, upper, step) if step is not None else np.linspace(lower, upper, points)
+
+    inputs = {'spot': spot, 'vol': vol, 'dte': dte}
+    inputs[axis] = x
+    timer = PhaseTimer('graph')
+    with timer.phase('chain'):
+        chain = BlackScholesChain(inputs['spot'], strike, rate, inputs['dte'], inputs['vol'], div)
+    side = 'call' if contract_type == 'C' else 'put'
+
+    with timer.phase('serialize'):
+        data = {
+            keys[axis]: x.tolist(),
+            'Delta': getattr(chain, f'{side}Delta').tolist(),
+            'Gamma': chain.gamma.tolist(),
+            'Vega': chain.vega.tolist(),
+            'Theta': getattr(chain, f'{side}Theta').tolist(),
+            'Rho': getattr(chain, f'{side}Rho').tolist(),
+        }
+    timer.record()
+
+    return data
 
 def graph(class_name, contract_type, upper_bound, lower_bound, strike, rate, vol, dte, div, market_price):
-    df = pd.DataFrame({'Strike': list(range(lower_bound, upper_bound))})
-    df['Delta'] = df['Gamma'] = df['Vega'] = df['Theta'] = df['Rho'] = 0
-
-    for i in range(len(df)):
-        if contract_type == 'C':
-            option = eval(class_name)(df.loc[i, 'Strike'], strike, rate, dte, vol, div, mktCallPrice=market_price)
-            df.loc[i, 'Delta'] = option.callDelta
-            df.loc[i, 'Theta'] = option.callTheta
-            df.loc[i, 'Rho'] = option.callRho
-        else:
-            option = eval(class_name)(df.loc[i, 'Strike'], strike, rate, dte, vol, div, mktPutPrice=market_price)
-            df.loc[i, 'Delta'] = option.putDelta
-            df.loc[i, 'Theta'] = option.putTheta
-            df.loc[i, 'Rho'] = option.putRho
-        df.loc[i, 'Gamma'] = option.gamma
-        df.loc[i, 'Vega'] = option.vega
-    
-    d = {key:list(df[key]) for key in df.columns}
+    """
+    Greeks for every integer spot in [lower_bound, upper_bound), kept for backward compatibility.
+    class_name and market_price are no longer used: the profile always comes from greek_profile.
+    """
+    d = greek_profile(contract_type, (upper_bound + lower_bound) / 2, strike, rate, vol, dte, div, lower=lower_bound, upper=upper_bound, step=1)
+    d['Strike'] = list(range(lower_bound, upper_bound))
 
     return d
 
@@ -48,4 +77,83 @@ def cdf(x, mu=0, sigma=1):
     """
     Calculate the cumulative distribution function (CDF) of the normal distribution.
     """
-    return (1 + math.erf((x - mu) / (sigma * math.sqrt(2)))) / 2
\ No newline at end of file
+    return (1 + math.erf((x - mu) / (sigma * math.sqrt(2)))) / 2
+
+def norm_pdf(x):
+    """
+    Vectorized probability density function (PDF) of the standard normal distribution.
+    """
+    x = np.asarray(x, dtype=float)
+    return np.exp(-0.5 * x * x) / math.sqrt(2 * math.pi)
+
+def norm_cdf(x):
+    """
+    Vectorized cumulative distribution function (CDF) of the standard normal distribution.
+    Uses Hart's double precision rational approximation (as given by West, 2005),
+    which agrees with the erf-based cdf above to ~1e-15.
+    """
+    x = np.asarray(x, dtype=float)
+    z = np.abs(x)
+    e = np.exp(-0.5 * z * z)
+
+    # Rational approximation for |x| < 7.07, evaluated in place
+    num = 3.52624965998911e-02 * z
+    num += 0.700383064443688
+    for coef in (6.37396220353165, 33.912866078383, 112.079291497871, 221.213596169931, 220.206867912376):
+        num *= z
+        num += coef
+    den = 8.83883476483184e-02 * z
+    den += 1.75566716318264
+    for coef in (16.064177579207, 86.7807322029461, 296.564248779674, 637.333633378831, 793.826512519948, 440.413735824752):
+        den *= z
+        den += coef
+    num *= e
+    num /= den
+    tail = np.asarray(num)
+
+    # Continued fraction for the far tail, only where it is needed
+    far = z >= 7.07106781186547
+    if far.any():
+        zf = z[far]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cf = zf + 0.65
+            cf = zf + 4 / cf
+            cf = zf + 3 / cf
+            cf = zf + 2 / cf
+            cf = zf + 1 / cf
+            tail[far] = e[far] / cf / 2.506628274631
+        tail[z > 37] = 0.0
+
+    return np.where(x > 0, 1 - tail, tail)
+
+def norm_ppf(p):
+    """
+    Vectorized inverse of the standard normal CDF (quantile function).
+    Uses Acklam's rational approximation refined with one Halley step on norm_cdf.
+    """
+    p = np.asarray(p, dtype=float)
+    a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01, -1.328068155288572e+01]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00]
+    p_low = 0.02425
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Central region
+        q = p - 0.5
+        r = q * q
+        central = (((((a[0]*r + a[1])*r + a[2])*r + a[3])*r + a[4])*r + a[5]) * q / (((((b[0]*r + b[1])*r + b[2])*r + b[3])*r + b[4])*r + 1)
+
+        # Tails, using the symmetry of the distribution
+        q = np.sqrt(-2 * np.log(np.minimum(p, 1 - p)))
+        tail = (((((c[0]*q + c[1])*q + c[2])*q + c[3])*q + c[4])*q + c[5]) / ((((d[0]*q + d[1])*q + d[2])*q + d[3])*q + 1)
+        tail = np.where(p < 0.5, tail, -tail)
+
+        x = np.where((p >= p_low) & (p <= 1 - p_low), central, tail)
+
+        # Halley refinement
+        e = norm_cdf(x) - p
+        u = e * math.sqrt(2 * math.pi) * np.exp(x * x / 2)
+        refined = x - u / (1 + x * u / 2)
+
+    return np.where(np.isfinite(refined), refined, x)